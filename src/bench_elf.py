@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Microbenchmarks for the ELF layer (clpc.elf, clpc.overlay, clpc.rpx)
+# Generates a synthetic big-endian RPL-like ELF and times each stage separately, along with its peak memory usage.
+
+
+from clpc.common import align
+from clpc.elf import ELF
+from clpc.index import getRelocationOffsets
+from clpc.index import RelocationIndex
+from clpc.overlay import ELFOverlay
+import argparse
+import gc
+import random
+import struct
+import time
+import tracemalloc
+
+
+SECTION_NAMES = (
+    "",
+    ".text",
+    ".rodata",
+    ".data",
+    ".bss",
+    ".rela.text",
+    ".symtab",
+    ".strtab",
+    ".shstrtab",
+    "",  # SHT_RPL_CRCS
+    ""   # SHT_RPL_FILEINFO
+)
+
+
+def generateELF(text_size, rela_count, sym_count, seed=0):
+    rng = random.Random(seed)
+
+    text_addr = 0x02000000
+    text_size = align(text_size, 4)
+    text_data = rng.randbytes(text_size)
+
+    rodata_data = rng.randbytes(text_size // 8)
+    data_data = rng.randbytes(text_size // 16)
+    bss_size = text_size // 16
+
+    strtab_data = bytearray(b'\0')
+    symtab_data = bytearray(0x10)
+    elf32_sym_pack = struct.Struct(">IIIBBH").pack
+    for i in range(sym_count):
+        name_offset = len(strtab_data)
+        strtab_data += b"sym_%08X\0" % i
+        bind = 0 if i < sym_count // 4 else 1
+        symtab_data += elf32_sym_pack(name_offset, text_addr + (i * 4) % text_size, 4, (bind << 4) | 2, 0, 1)
+
+    # Relocations are sorted by offset, as they are in RPL files
+    elf32_rela_pack = struct.Struct(">2Ii").pack
+    rela_step = max(text_size // max(rela_count, 1), 4) & ~3
+    rela_data = b''.join([
+        elf32_rela_pack(text_addr + (i * rela_step) % text_size, (rng.randrange(1, sym_count + 1) << 8) | 1, 0)
+        for i in range(rela_count)
+    ])
+
+    sh_str_data = bytearray(b'\0')
+    name_offsets = []
+    for name in SECTION_NAMES:
+        if name:
+            name_offsets.append(len(sh_str_data))
+            sh_str_data += name.encode() + b'\0'
+
+        else:
+            name_offsets.append(0)
+
+    fileinfo_data = bytearray(0x60)
+    fileinfo_data[0:4] = b'\xCA\xFE\x04\x02'
+
+    data_addr = 0x10000000
+    sections = (
+        # type, flags, vAddr, data, link, info, addrAlign, entSize
+        (0, 0, 0, b'', 0, 0, 0, 0),
+        (1, 6, text_addr, text_data, 0, 0, 32, 0),
+        (1, 2, data_addr, rodata_data, 0, 0, 32, 0),
+        (1, 3, align(data_addr + len(rodata_data), 32), data_data, 0, 0, 32, 0),
+        (8, 3, align(data_addr + len(rodata_data) + len(data_data), 64), bss_size, 0, 0, 64, 0),
+        (4, 0, 0, rela_data, 6, 1, 4, 12),
+        (2, 2, 0xC0000000, symtab_data, 7, sym_count // 4 + 1, 4, 0x10),
+        (3, 2, align(0xC0000000 + len(symtab_data), 4), strtab_data, 0, 0, 1, 0),
+        (3, 0, 0, sh_str_data, 0, 0, 1, 0),
+        (0x80000003, 0, 0, bytes(4 * len(SECTION_NAMES)), 0, 0, 4, 4),
+        (0x80000004, 0, 0, fileinfo_data, 0, 0, 4, 0)
+    )
+
+    section_count = len(sections)
+    sh_str_idx = SECTION_NAMES.index(".shstrtab")
+
+    outBuffer = bytearray(b'\x7FELF\x01\x02\x01\xCA\xFE' + b'\0' * 7)
+    outBuffer += struct.pack(">2H5I6H", 0xFE01, 0x14, 1, text_addr, 0, 0x40, 0, 0x34, 0, 0, 0x28, section_count, sh_str_idx)
+    outBuffer += b'\0' * (0x40 - len(outBuffer))
+
+    offset = 0x40 + section_count * 0x28
+    for (type_, flags, vAddr, data, link, info, addrAlign, entSize), name_offset in zip(sections, name_offsets):
+        if type_ == 8:
+            outBuffer += struct.pack(">10I", name_offset, type_, flags, vAddr, 0, data, link, info, addrAlign, entSize)
+
+        else:
+            outBuffer += struct.pack(">10I", name_offset, type_, flags, vAddr, offset if data else 0, len(data), link, info, addrAlign, entSize)
+            offset += len(data)
+
+    for type_, _, _, data, _, _, _, _ in sections:
+        if type_ != 8:
+            outBuffer += data
+
+    return outBuffer
+
+
+def benchParse(image, _):
+    return ELF(image)
+
+
+def benchGetSectionByName(_, elf):
+    for name in SECTION_NAMES[1:9] * 1000:
+        elf.getSectionByName(name)
+
+    return elf
+
+
+def benchRelaLoad(_, elf):
+    rela = elf.getSectionByName(".rela.text")
+    rela.loadRela(ELF.Rela32, elf.header.endian)
+    return elf
+
+
+def benchRelaSave(_, elf):
+    elf.getSectionByName(".rela.text").saveRela()
+    return elf
+
+
+def benchPatch(_, elf, patch_count=5000):
+    overlay = ELFOverlay(elf)
+
+    text = overlay.getSectionByName(".text")
+    rela = overlay.getSectionByName(".rela.text")
+    rela_index = RelocationIndex(getRelocationOffsets(rela, elf.header.endian))
+
+    rng = random.Random(1)
+    text_size = len(text.data)
+
+    for _ in range(patch_count):
+        offset = rng.randrange(0, text_size - 0x20) & ~3
+        data = b'\x60\x00\x00\x00' * 8
+        overlay.patch(text, offset, data)
+
+        address = text.vAddr + offset
+        overlay.removeRelocations(rela, rela_index.find(address, address + len(data)))
+
+    overlay.getData(text)
+    overlay.getData(rela)
+    return overlay
+
+
+def benchSave(_, elf):
+    elf.save()
+    return elf
+
+
+def benchSaveRpx(_, elf):
+    ELFOverlay(elf).saveRpx()
+    return elf
+
+
+BENCHMARKS = (
+    ("ELF() parse",         benchParse,             False),
+    ("getSectionByName",    benchGetSectionByName,  True),
+    ("relocation load",     benchRelaLoad,          True),
+    ("relocation save",     benchRelaSave,          True),
+    ("patch application",   benchPatch,             True),
+    ("save()",              benchSave,              True),
+    ("saveRpx()",           benchSaveRpx,           True)
+)
+
+
+def run(image, repeat, track_memory):
+    results = []
+
+    elf = ELF(image)
+
+    for name, func, needs_elf in BENCHMARKS:
+        best = None
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            func(image, elf if needs_elf else None)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        peak = None
+        if track_memory:
+            gc.collect()
+            tracemalloc.start()
+            func(image, elf if needs_elf else None)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        results.append((name, best, peak))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the clpc ELF layer on a synthetic RPL-like ELF.")
+    parser.add_argument("--text-size", type=lambda s: int(s, 0), default=32 * 1024 * 1024, help="size of .text in bytes (default: 32 MiB)")
+    parser.add_argument("--relocations", type=int, default=500000, help="number of .text relocations (default: 500000)")
+    parser.add_argument("--symbols", type=int, default=200000, help="number of symbols (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per benchmark; the best is reported (default: 3)")
+    parser.add_argument("--no-memory", action="store_true", help="do not track peak memory usage")
+    args = parser.parse_args()
+
+    print("Generating ELF (.text: 0x%X bytes, %d relocations, %d symbols)..." % (args.text_size, args.relocations, args.symbols))
+    image = generateELF(args.text_size, args.relocations, args.symbols)
+    print("ELF size: 0x%X bytes\n" % len(image))
+
+    results = run(image, args.repeat, not args.no_memory)
+
+    print("%-20s %12s %14s" % ("Benchmark", "Time (ms)", "Peak (MiB)"))
+    for name, elapsed, peak in results:
+        print("%-20s %12.2f %14s" % (name, elapsed * 1000, "-" if peak is None else "%.2f" % (peak / (1024 * 1024))))
+
+
+if __name__ == "__main__":
+    main()
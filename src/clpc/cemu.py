@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Cemu graphic pack output - Emits the hax code, data and hook patches as a Cemu patch set (rules.txt + patch_<name>.asm),
+# which Cemu applies to the unmodified base RPX when loading it
+# (patches.txt is avoided, as Cemu parses it with the legacy Cemuhook patch parser)
+# https://wiki.cemu.info/wiki/Tutorial:Graphic_packs
+
+
+# Built-in
+import struct
+import zlib
+
+
+# Emulator target outputs ("EmulatorOutput" target option)
+EMULATOR_OUTPUT_RPX = "rpx"    # Rebuilt RPX
+EMULATOR_OUTPUT_CEMU = "cemu"  # Cemu graphic pack
+
+EMULATOR_OUTPUTS = (EMULATOR_OUTPUT_RPX, EMULATOR_OUTPUT_CEMU)
+
+# Start of the Cemu code cave, where ".origin = codecave" content is placed
+CEMU_CODECAVE_ADDR = 0x01800000
+
+# Size of the Cemu code cave, which holds both the hax code and data
+CEMU_CODECAVE_SIZE = 0x00800000
+
+# Offset of the hax data in the code cave (the hax code starts at the beginning of it)
+CEMU_CODECAVE_DATA_OFFSET = 0x00400000
+
+CEMU_RULES_VERSION = 7
+
+CEMU_RULES_TEMPLATE = """[Definition]
+titleIds = %s
+name = %s
+path = "%s"
+description = %s
+version = %d
+"""
+
+
+def getModuleMatches(rpx):
+    """
+    Returns the module checksum Cemu matches patch groups against, i.e., the CRC-32 of the SHT_RPL_CRCS table of 'rpx'.
+    """
+
+    assert rpx.crcs is not None
+    return zlib.crc32(struct.pack(">%dI" % len(rpx.crcs), *rpx.crcs)) & 0xFFFFFFFF
+
+
+def formatData(data, address=None):
+    """
+    Returns the Cemu assembler lines writing 'data', one word per line.
+    Lines are prefixed with their address if 'address' is given (patches), and are placed sequentially otherwise (code cave).
+    """
+
+    data = bytes(data)
+    size = len(data)
+    word_size = size & ~3
+
+    values = [(".int 0x%08X" % v) for (v,) in struct.iter_unpack(">I", data[:word_size])]
+    values.extend((".byte 0x%02X" % v) for v in data[word_size:])
+
+    if address is None:
+        return values
+
+    offsets = list(range(0, word_size, 4)) + list(range(word_size, size))
+    return ["0x%08X = %s" % (address + offset, value) for offset, value in zip(offsets, values)]
+
+
+def getPatchFileName(name):
+    return "patch_%s.asm" % name.replace(' ', '_')
+
+
+class CemuPatchSink:
+    """
+    Collects hook patches as Cemu patch lines.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.count = 0
+
+    def add(self, address, data, _):
+        self.lines.extend(formatData(data, address))
+        self.count += 1
+
+    def finish(self):
+        return self.lines
+
+
+def saveGraphicPack(name, path, title_ids, module_matches, code, data, patch_lines):
+    """
+    Returns the contents of (rules.txt, patch_<name>.asm).
+
+    Notes:
+    * 'code' and 'data' are the hax code and data, linked at CEMU_CODECAVE_ADDR and
+      CEMU_CODECAVE_ADDR + CEMU_CODECAVE_DATA_OFFSET respectively.
+    * 'title_ids' is a list of 16-digit hex title ID strings.
+    """
+
+    if len(code) > CEMU_CODECAVE_DATA_OFFSET:
+        raise ValueError("Code (0x%X bytes) does not fit before the data in the Cemu code cave (0x%X bytes)" % (len(code), CEMU_CODECAVE_DATA_OFFSET))
+
+    if len(data) > CEMU_CODECAVE_SIZE - CEMU_CODECAVE_DATA_OFFSET:
+        raise ValueError("Data (0x%X bytes) does not fit in the Cemu code cave (0x%X bytes from the data offset)" % (len(data), CEMU_CODECAVE_SIZE - CEMU_CODECAVE_DATA_OFFSET))
+
+    rules = CEMU_RULES_TEMPLATE % (
+        ','.join(title_ids),
+        name,
+        path,
+        "Generated by CLPC",
+        CEMU_RULES_VERSION
+    )
+
+    lines = [
+        "[%s]" % name.replace(' ', '_'),
+        "moduleMatches = 0x%08X" % module_matches,
+        "",
+        ".origin = codecave",
+        ""
+    ]
+
+    lines.extend(formatData(code))
+
+    if data:
+        if not code:
+            lines.append(".int 0x00000000")  # .align is a no-op at the start of the code cave
+
+        lines.append("")
+        lines.append(".align 0x%X" % CEMU_CODECAVE_DATA_OFFSET)
+        lines.extend(formatData(data))
+
+    lines.append("")
+    lines.extend(patch_lines)
+    lines.append("")
+
+    return rules, '\n'.join(lines)
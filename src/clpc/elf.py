@@ -28,7 +28,7 @@ def readString(data, offset=0, charWidth=1, encoding='utf-8'):
 
 class ELF:
     class _SectionHeader(struct.Struct):
-        def __init__(self, data, offset, format_, rela):
+        def __init__(self, data, offset, format_, rela, lazy_relocations=False):
             super().__init__(format_)
 
             (self.nameIdx,
@@ -58,10 +58,27 @@ class ELF:
                 self.data = bytearray(data[self.offset:self.offset + self.size_])
 
                 if self.type == 4:
-                    self.loadRela(rela, format_[0])
+                    if lazy_relocations:
+                        # Parsed on first access
+                        self._relocations = None
+                        self._rela = (rela, format_[0])
+
+                    else:
+                        self.loadRela(rela, format_[0])
 
             self.name = 'None'
 
+        @property
+        def relocations(self):
+            if self._relocations is None:
+                self.loadRela(*self._rela)
+
+            return self._relocations
+
+        @relocations.setter
+        def relocations(self, relocations):
+            self._relocations = relocations
+
         def loadRela(self, rela, endian):
             count = len(self.data) // self.entSize
             self.relocations = []
@@ -133,12 +150,12 @@ class ELF:
             )
 
     class SectionHeader32(_SectionHeader):
-        def __init__(self, data, offset, endian):
-            super().__init__(data, offset, '%s10I' % endian, ELF.Rela32)
+        def __init__(self, data, offset, endian, lazy_relocations=False):
+            super().__init__(data, offset, '%s10I' % endian, ELF.Rela32, lazy_relocations)
 
     class SectionHeader64(_SectionHeader):
-        def __init__(self, data, offset, endian):
-            super().__init__(data, offset, '%s2I4Q2I2Q' % endian, ELF.Rela64)
+        def __init__(self, data, offset, endian, lazy_relocations=False):
+            super().__init__(data, offset, '%s2I4Q2I2Q' % endian, ELF.Rela64, lazy_relocations)
 
     class _Rela(struct.Struct):
         def __init__(self, data, offset, format_):
@@ -285,9 +302,13 @@ class ELF:
 
             return outBuffer
 
-    def __init__(self, file):
-        with open(file, "rb") as inf:
-            inb = inf.read()
+    def __init__(self, file, lazy_relocations=False):
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            inb = file
+
+        else:
+            with open(file, "rb") as inf:
+                inb = inf.read()
 
         self.header = self.Header(inb)
         pos = self.header.size_
@@ -304,10 +325,10 @@ class ELF:
 
             for i in range(self.header.secHeadNum):
                 if self.header.ident.class_ == 1:
-                    entry = ELF.SectionHeader32(inb, pos, self.header.endian)
+                    entry = ELF.SectionHeader32(inb, pos, self.header.endian, lazy_relocations)
 
                 else:
-                    entry = ELF.SectionHeader64(inb, pos, self.header.endian)
+                    entry = ELF.SectionHeader64(inb, pos, self.header.endian, lazy_relocations)
 
                 if i == self.header.namesSecHeadIdx:
                     assert entry.isStrTable
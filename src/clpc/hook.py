@@ -3,23 +3,93 @@
 
 
 # Built-in
+from array import array
 from enum import auto as enum_auto
 from enum import IntEnum
 from enum import IntFlag
+import math
+import mmap
+import os
+import struct
+import sys
 
 
 # Local
-from .common import align
-from .common import PACK_F32
-from .common import PACK_F64
-from .common import PACK_S16
-from .common import PACK_S32
-from .common import PACK_S64
-from .common import PACK_S8
-from .common import PACK_U16
 from .common import PACK_U32
-from .common import PACK_U64
-from .common import PACK_U8
+from .ppcAsm import AsmError
+from .ppcAsm import Program as AsmProgram
+
+
+ARRAY_TYPECODE_U32 = 'I' if array('I').itemsize == 4 else 'L'
+ARRAY_TYPECODE_S32 = 'i' if array('i').itemsize == 4 else 'l'
+
+# Largest data a single hook may patch at one address, which keeps a mistyped count from expanding to gigabytes
+HOOK_DATA_MAX_SIZE = 0x01000000
+NOP_MAX_COUNT = HOOK_DATA_MAX_SIZE // 4
+
+
+def isHexString(s):
+    # Validated by the (C) hex decoder instead of character by character
+    if not s or len(s) % 2 != 0 or not s.isascii() or not s.isalnum():
+        return False
+
+    try:
+        bytes.fromhex(s)
+    except ValueError:
+        return False
+
+    return True
+
+
+def valuesToArray(typecode, values):
+    """
+    Converts 'values' to an array of 'typecode' in one go.
+    Returns None if any value has the wrong type or is out of range.
+    """
+
+    if typecode in ('f', 'd'):
+        if not all(isinstance(v, float) for v in values):
+            return None
+
+    try:
+        values_array = array(typecode, values)
+    except (OverflowError, TypeError):
+        return None
+
+    if typecode == 'f' and any(map(math.isinf, values_array)):
+        # Finite values too large for f32 silently become infinite
+        if any(math.isinf(a) and not math.isinf(v) for a, v in zip(values_array, values)):
+            return None
+
+    return values_array
+
+
+def resolveSymbols(hooks, symbols):
+    """
+    Maps every symbol referenced by 'hooks' (as written) to its address in 'symbols', in one pass.
+    The result is the symbol map to pass to the hooks' getData.
+    Raises KeyError listing all symbols not found.
+    """
+
+    resolved = {}
+    missing = []
+
+    for hook in hooks:
+        for func in hook.getSymbols():
+            if func in resolved:
+                continue
+
+            name = func if func in symbols else func.strip()
+            if name in symbols:
+                resolved[func] = symbols[name]
+
+            elif name not in missing:
+                missing.append(name)
+
+    if missing:
+        raise KeyError("Hook function symbol(s) not found: %s" % ', '.join(map(repr, missing)))
+
+    return resolved
 
 
 class BasicHook:
@@ -35,6 +105,22 @@ class BasicHook:
     def getData(self, *_):
         raise NotImplementedError
 
+    def getDataSize(self):
+        # Size of the patched data, which must be known before symbols are available
+        raise NotImplementedError
+
+    def getFill(self):
+        # (pattern, count) if the data is a single pattern repeated 'count' times, None otherwise
+        return None
+
+    def isAddressIndependent(self):
+        # Whether the data is the same for every address
+        return False
+
+    def getSymbols(self):
+        # Symbols referenced by the data, which must be in the map passed to getData
+        return ()
+
     @staticmethod
     def checkObj(obj, hook_field_name, available_options, error=print):
         if "addr" not in obj:
@@ -150,6 +236,47 @@ class PatchHook(BasicHook):
 
             return tuple()
 
+        def alignment(self):
+            self_type = PatchHook.Type
+
+            conv = {
+                self_type.U8:       1,
+                self_type.U16:      2,
+                self_type.U32:      4,
+                self_type.U64:      8,
+                self_type.S8:       1,
+                self_type.S16:      2,
+                self_type.S32:      4,
+                self_type.S64:      8,
+                self_type.F32:      4,
+                self_type.F64:      8,
+                self_type.Char:     1,
+                self_type.String:   4,
+                self_type.WChar:    2,
+                self_type.WString:  4
+            }
+
+            return conv[self & ~self_type.Array]
+
+        def arrayTypecode(self):
+            # 'array' type code of numeric types, None for the others
+            self_type = PatchHook.Type
+
+            conv = {
+                self_type.U8:       'B',
+                self_type.U16:      'H',
+                self_type.U32:      ARRAY_TYPECODE_U32,
+                self_type.U64:      'Q',
+                self_type.S8:       'b',
+                self_type.S16:      'h',
+                self_type.S32:      ARRAY_TYPECODE_S32,
+                self_type.S64:      'q',
+                self_type.F32:      'f',
+                self_type.F64:      'd'
+            }
+
+            return conv.get(self & ~self_type.Array)
+
         def defaultEncoding(self):
             self_type = PatchHook.Type
             encd_type = PatchHook.Encoding
@@ -238,6 +365,9 @@ class PatchHook(BasicHook):
 
             raise ValueError("Invalid type string %r" % string)
 
+    # Hooks whose file source is currently mapped
+    mappedHooks = []
+
     def __init__(self):
         super().__init__()
 
@@ -245,69 +375,142 @@ class PatchHook(BasicHook):
         self.type = PatchHook.Type.Raw
         self.encoding = None
 
+        # External data source (in place of "data")
+        self.file = None
+        self.fileOffset = 0
+        self.fileLength = 0
+        self.fileMap = None
+
     def getData(self, *_):
         if self.dataCache is not None:
             return self.dataCache
 
-        patch_type_type = PatchHook.Type
+        if self.file is not None:
+            # Mapped read-only and handed out as a view, without any intermediate copy
+            # The mapping stays open until PatchHook.closeFiles() is called at the end of the build
+            with open(self.file, "rb") as inf:
+                file_size = os.fstat(inf.fileno()).st_size
+                if file_size < self.fileOffset + self.fileLength:
+                    # The file shrank after it was validated, which would otherwise be patched as a short read
+                    raise ValueError("Patch data file is 0x%X bytes, expected at least 0x%X bytes: %s" % (file_size, self.fileOffset + self.fileLength, self.file))
+
+                file_map = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.fileMap = file_map
+            PatchHook.mappedHooks.append(self)
+
+            self.dataCache = memoryview(file_map)[self.fileOffset:self.fileOffset + self.fileLength]
+            return self.dataCache
 
         type_ = self.type
         data = self.data
 
-        if type_ == patch_type_type.Raw:
+        if type_ == PatchHook.Type.Raw:
             data_buf = bytearray.fromhex(data)
 
+        elif isinstance(data, array):
+            # Numeric values are kept as a native array, and converted to big-endian in one go
+            if data.itemsize > 1 and sys.byteorder == "little":
+                data = array(data.typecode, data)
+                data.byteswap()
+
+            data_buf = data.tobytes()
+
         else:
-            encode = {
-                patch_type_type.U8:         PACK_U8,
-                patch_type_type.U16:        PACK_U16,
-                patch_type_type.U32:        PACK_U32,
-                patch_type_type.U64:        PACK_U64,
-                patch_type_type.S8:         PACK_S8,
-                patch_type_type.S16:        PACK_S16,
-                patch_type_type.S32:        PACK_S32,
-                patch_type_type.S64:        PACK_S64,
-                patch_type_type.F32:        PACK_F32,
-                patch_type_type.F64:        PACK_F64,
-                patch_type_type.Char:       lambda v: bytes((ord(v),)),
-                patch_type_type.String:     lambda v: v,
-                patch_type_type.WChar:      lambda v: v,
-                patch_type_type.WString:    lambda v: v
-            }[type_]
-
-            alignment = {
-                patch_type_type.U8:         1,
-                patch_type_type.U16:        2,
-                patch_type_type.U32:        4,
-                patch_type_type.U64:        8,
-                patch_type_type.S8:         1,
-                patch_type_type.S16:        2,
-                patch_type_type.S32:        4,
-                patch_type_type.S64:        8,
-                patch_type_type.F32:        4,
-                patch_type_type.F64:        8,
-                patch_type_type.Char:       1,
-                patch_type_type.String:     4,
-                patch_type_type.WChar:      2,
-                patch_type_type.WString:    4
-            }[type_]
-
-            f_align = align
-
-            data_buf = bytearray()
+            # Already encoded characters and strings, padded to their alignment and joined in bulk
+            alignment = type_.alignment()
+
+            pieces = []
+            pos = 0
             for v in data:
-                current_pos = len(data_buf)
-                pad_size = f_align(current_pos, alignment) - current_pos
-                data_buf += b'\0' * pad_size
-                data_buf += encode(v)
+                pad_size = -pos & (alignment - 1)
+                if pad_size:
+                    pieces.append(b'\0' * pad_size)
+
+                pieces.append(v)
+                pos += pad_size + len(v)
+
+            data_buf = b''.join(pieces)
 
             # print(type_, data, data_buf)
 
         self.dataCache = data_buf
         return data_buf
 
+    def getDataSize(self):
+        if self.file is not None:
+            return self.fileLength
+
+        return len(self.getData())
+
     @staticmethod
-    def fromObj(obj, module_field_name, proj, error=print):
+    def closeFiles():
+        """
+        Closes the mappings of all file sources, and drops their views.
+        A mapping that is still referenced by a patch (i.e., a slice of a view) is instead closed once that patch is freed.
+        """
+
+        mapped_hooks = PatchHook.mappedHooks
+
+        while mapped_hooks:
+            hook = mapped_hooks.pop()
+
+            file_map = hook.fileMap
+            hook.fileMap = None
+
+            hook.dataCache.release()
+            hook.dataCache = None
+
+            try:
+                file_map.close()
+            except BufferError:
+                pass
+
+    def isAddressIndependent(self):
+        return True
+
+    def fileFromObj(self, obj, hook_field_name, proj, base_path, error=print):
+        for k in ("data", "datatype", "encoding"):
+            if k in obj:
+                error("In %s, \"%s\" cannot be used alongside \"file\"" % (hook_field_name, k))
+                return False
+
+        file_path = proj.readString(obj, "file", "%s File" % hook_field_name, error=error)
+        if file_path is None:
+            return False
+
+        if not os.path.isabs(file_path) and base_path is not None:
+            file_path = os.path.join(base_path, file_path)
+
+        if not os.path.isfile(file_path):
+            error("In %s,\n"
+                  "File not found: %r" % (hook_field_name, str(file_path)))
+            return False
+
+        file_size = os.path.getsize(file_path)
+
+        offset = obj.get("offset", 0)
+        if not (isinstance(offset, int) and 0 <= offset < file_size):
+            error("In %s, expected \"offset\" to be a non-negative integer within the file size (0x%X), received: %r" % (hook_field_name, file_size, offset))
+            return False
+
+        length = obj.get("length", file_size - offset)
+        if not (isinstance(length, int) and 0 < length <= file_size - offset):
+            error("In %s, expected \"length\" to be a positive integer of at most 0x%X, received: %r" % (hook_field_name, file_size - offset, length))
+            return False
+
+        self.file = file_path
+        self.fileOffset = offset
+        self.fileLength = length
+        return True
+
+    @staticmethod
+    def fromObj(obj, module_field_name, proj, error=print, base_path=None):
+        """
+        Notes:
+        * 'base_path' is the directory relative "file" paths are resolved against.
+        """
+
         hook_field_name = "%s Patch Hook" % module_field_name
 
         ### Selected Options Sanity Check ###
@@ -316,7 +519,7 @@ class PatchHook(BasicHook):
         if not BasicHook.checkObj(
             obj,
             hook_field_name,
-            ("data", "datatype", "encoding"),
+            ("data", "datatype", "encoding", "file", "offset", "length"),
             error=error
         ):
             return None
@@ -330,6 +533,19 @@ class PatchHook(BasicHook):
         if not hook.baseFromObj(obj, hook_field_name, error):
             return None
 
+        ### External Data Source Reading ###
+
+        if "file" in obj:
+            if not hook.fileFromObj(obj, hook_field_name, proj, base_path, error):
+                return None
+
+            return hook
+
+        for k in ("offset", "length"):
+            if k in obj:
+                error("In %s, \"%s\" can only be used alongside \"file\"" % (hook_field_name, k))
+                return None
+
         ### Check Mandatory Variable-Type Attributes ###
 
         if "data" not in obj:
@@ -366,33 +582,18 @@ class PatchHook(BasicHook):
 
             data_str = ''.join(data.split())
 
-            hex_digits = "0123456789ABCDEFabcdef"
-            is_hex_digit = lambda c: c in hex_digits
-            is_hex_str = lambda s: s and len(s) % 2 == 0 and all(is_hex_digit(c) for c in s)
-
-            if not is_hex_str(data_str):
+            if not isHexString(data_str):
                 error("In %s, expected \"data\" to be a valid hex string of even length, received: %r" % (hook_field_name, data))
                 return None
 
+            if len(data_str) // 2 > HOOK_DATA_MAX_SIZE:
+                error("In %s, expected \"data\" to be at most 0x%X bytes long, received 0x%X bytes" % (hook_field_name, HOOK_DATA_MAX_SIZE, len(data_str) // 2))
+                return None
+
             hook.data = data_str
 
         else:
-            alignment = {
-                patch_type_type.U8:         1,
-                patch_type_type.U16:        2,
-                patch_type_type.U32:        4,
-                patch_type_type.U64:        8,
-                patch_type_type.S8:         1,
-                patch_type_type.S16:        2,
-                patch_type_type.S32:        4,
-                patch_type_type.S64:        8,
-                patch_type_type.F32:        4,
-                patch_type_type.F64:        8,
-                patch_type_type.Char:       1,
-                patch_type_type.String:     4,
-                patch_type_type.WChar:      2,
-                patch_type_type.WString:    4
-            }[type_no_array]
+            alignment = type_no_array.alignment()
 
             for address in hook.address:
                 if address & (alignment - 1) != 0:
@@ -445,12 +646,28 @@ class PatchHook(BasicHook):
             f_check = check[type_no_array]
             data_error_msg = error_msgs[type_no_array]
 
-            for v in data:
-                if not f_check(v):
-                    error(data_error_msg % v)
+            typecode = type_no_array.arrayTypecode()
+            values = None if typecode is None else valuesToArray(typecode, data)
+
+            if values is None:
+                # Checked one by one, to find the offending value
+                for v in data:
+                    if not f_check(v):
+                        error(data_error_msg % v)
+                        return None
+
+                if typecode is not None:
+                    error("In %s, data out of range for its data type" % hook_field_name)
                     return None
 
-            hook.data = data
+            if values is not None:
+                hook.data = values
+
+            elif type_no_array == patch_type_type.Char:
+                hook.data = [b'\0' if v is None else v.encode("ascii") for v in data]
+
+            else:
+                hook.data = data
 
         ### Encoding Reading ###
 
@@ -521,6 +738,15 @@ class NOPHook(BasicHook):
 
         return self.dataCache
 
+    def getDataSize(self):
+        return 4 * self.count
+
+    def getFill(self):
+        return b"\x60\x00\x00\x00", self.count
+
+    def isAddressIndependent(self):
+        return True
+
     @staticmethod
     def fromObj(obj, module_field_name, proj, error=print):
         hook_field_name = "%s NOP Hook" % module_field_name
@@ -547,6 +773,82 @@ class NOPHook(BasicHook):
 
         ### Count Reading ###
 
+        if "count" in obj:
+            count = obj["count"]
+            if not (isinstance(count, int) and 0 < count <= NOP_MAX_COUNT):
+                error("In %s, expected count to be an integer in the range [1, %d], received: %r" % (hook_field_name, NOP_MAX_COUNT, count))
+                return None
+
+            hook.count = count
+
+        ### Success ###
+
+        return hook
+
+
+class FillHook(BasicHook):
+    def __init__(self):
+        super().__init__()
+
+        self.pattern = b"\x00"
+        self.count = 1
+
+    def getData(self, *_):
+        if self.dataCache is None:
+            self.dataCache = self.pattern * self.count
+
+        return self.dataCache
+
+    def getDataSize(self):
+        return len(self.pattern) * self.count
+
+    def isAddressIndependent(self):
+        return True
+
+    def getFill(self):
+        return self.pattern, self.count
+
+    @staticmethod
+    def fromObj(obj, module_field_name, proj, error=print):
+        hook_field_name = "%s Fill Hook" % module_field_name
+
+        ### Selected Options Sanity Check ###
+        # print("%s Selected Options Sanity Check" % hook_field_name)
+
+        if not BasicHook.checkObj(
+            obj,
+            hook_field_name,
+            ("pattern", "count"),
+            error=error
+        ):
+            return None
+
+        ### Hook Initialization ###
+
+        hook = FillHook()
+
+        ### Read Base Options ###
+
+        if not hook.baseFromObj(obj, hook_field_name, error):
+            return None
+
+        ### Pattern Reading ###
+
+        if "pattern" in obj:
+            pattern = proj.processString("%s Pattern" % hook_field_name, obj["pattern"], error=error)
+            if pattern is None:
+                return None
+
+            pattern_str = ''.join(pattern.split())
+
+            if not (isHexString(pattern_str) and len(pattern_str) <= 0x1FFFE):
+                error("In %s, expected \"pattern\" to be a valid hex string of even length, at most 0xFFFF bytes long, received: %r" % (hook_field_name, pattern))
+                return None
+
+            hook.pattern = bytes.fromhex(pattern_str)
+
+        ### Count Reading ###
+
         if "count" in obj:
             count = obj["count"]
             if not (isinstance(count, int) and count > 0):
@@ -555,6 +857,10 @@ class NOPHook(BasicHook):
 
             hook.count = count
 
+        if hook.getDataSize() > HOOK_DATA_MAX_SIZE:
+            error("In %s, expected the filled size to be at most 0x%X bytes, received 0x%X bytes" % (hook_field_name, HOOK_DATA_MAX_SIZE, hook.getDataSize()))
+            return None
+
         ### Success ###
 
         return hook
@@ -564,6 +870,12 @@ class ReturnHook(BasicHook):
     def getData(self, *_):
         return b"\x4E\x80\x00\x20"
 
+    def getDataSize(self):
+        return 4
+
+    def isAddressIndependent(self):
+        return True
+
     @staticmethod
     def fromObj(obj, module_field_name, proj, error=print):
         hook_field_name = "%s Return Hook" % module_field_name
@@ -619,13 +931,7 @@ class BranchHook(BasicHook):
         self.func = None
 
     def getData(self, address, symbols):
-        func = self.func
-        if func not in symbols:
-            func = func.strip()
-            if func not in symbols:
-                raise KeyError("In Branch Hook, function symbol not found: %r" % self.func)
-
-        func_address = symbols[func]
+        func_address = symbols[self.func]
 
         key = (address << 32) | func_address
         if self.dataCache is None:
@@ -643,6 +949,12 @@ class BranchHook(BasicHook):
         self.dataCache[key] = data_buf
         return data_buf
 
+    def getDataSize(self):
+        return 4
+
+    def getSymbols(self):
+        return (self.func,)
+
     @staticmethod
     def fromObj(obj, module_field_name, proj, error=print):
         hook_field_name = "%s Branch Hook" % module_field_name
@@ -701,13 +1013,7 @@ class FuncPtrHook(BasicHook):
         self.func = None
 
     def getData(self, _, symbols):
-        func = self.func
-        if func not in symbols:
-            func = func.strip()
-            if func not in symbols:
-                raise KeyError("In Branch Hook, function symbol not found: %r" % self.func)
-
-        func_address = symbols[func]
+        func_address = symbols[self.func]
 
         key = func_address
         if self.dataCache is None:
@@ -719,6 +1025,15 @@ class FuncPtrHook(BasicHook):
         self.dataCache[key] = data_buf
         return data_buf
 
+    def getDataSize(self):
+        return 4
+
+    def isAddressIndependent(self):
+        return True
+
+    def getSymbols(self):
+        return (self.func,)
+
     @staticmethod
     def fromObj(obj, module_field_name, proj, error=print):
         hook_field_name = "%s Function Pointer Hook" % module_field_name
@@ -754,3 +1069,175 @@ class FuncPtrHook(BasicHook):
         ### Success ###
 
         return hook
+
+
+class FuncPtrArrayHook(BasicHook):
+    def __init__(self):
+        super().__init__()
+
+        self.funcs = []
+
+    def getData(self, _, symbols):
+        func_addresses = [symbols[func] for func in self.funcs]
+
+        key = tuple(func_addresses)
+        if self.dataCache is None:
+            self.dataCache = {}
+        elif key in self.dataCache:
+            return self.dataCache[key]
+
+        data_buf = struct.pack(">%dI" % len(func_addresses), *func_addresses)
+        self.dataCache[key] = data_buf
+        return data_buf
+
+    def getDataSize(self):
+        return 4 * len(self.funcs)
+
+    def getSymbols(self):
+        return self.funcs
+
+    def isAddressIndependent(self):
+        return True
+
+    @staticmethod
+    def fromObj(obj, module_field_name, proj, error=print):
+        hook_field_name = "%s Function Pointer Array Hook" % module_field_name
+
+        ### Selected Options Sanity Check ###
+        # print("%s Selected Options Sanity Check" % hook_field_name)
+
+        if not BasicHook.checkObj(
+            obj,
+            hook_field_name,
+            ("funcs",),
+            error=error
+        ):
+            return None
+
+        ### Hook Initialization ###
+
+        hook = FuncPtrArrayHook()
+
+        ### Read Base Options ###
+
+        if not hook.baseFromObj(obj, hook_field_name, error):
+            return None
+
+        for address in hook.address:
+            if address & 3 != 0:
+                error("In %s, expected value in \"addr\" [0x%08X] to be aligned by %d" % (hook_field_name, address, 4))
+                return None
+
+        ### Function Symbols Reading ###
+
+        if "funcs" not in obj:
+            error("%s Function Symbols not specified" % hook_field_name)
+            return None
+
+        funcs = obj["funcs"]
+        if not isinstance(funcs, list) or not funcs:
+            error("In %s, expected \"funcs\" to be a non-empty list of function symbols" % hook_field_name)
+            return None
+
+        funcs_new = []
+        for i, func in enumerate(funcs):
+            func = proj.processString("%s Function Symbol %d" % (hook_field_name, i), func, error=error)
+            if func is None:
+                return None
+
+            funcs_new.append(func)
+
+        hook.funcs = funcs_new
+
+        ### Success ###
+
+        return hook
+
+
+class AsmHook(BasicHook):
+    def __init__(self):
+        super().__init__()
+
+        self.program = None
+
+    def getData(self, address, symbols):
+        key = (address, *(symbols[symbol] for symbol in self.program.getSymbols()))
+        if self.dataCache is None:
+            self.dataCache = {}
+        elif key in self.dataCache:
+            return self.dataCache[key]
+
+        try:
+            data_buf = self.program.assemble(address, symbols)
+        except AsmError as e:
+            raise AsmError("In assembly hook at 0x%08X, %s" % (address, e)) from None
+
+        self.dataCache[key] = data_buf
+        return data_buf
+
+    def getDataSize(self):
+        return self.program.size
+
+    def getSymbols(self):
+        return self.program.getSymbols()
+
+    @staticmethod
+    def fromObj(obj, module_field_name, proj, error=print):
+        hook_field_name = "%s Assembly Hook" % module_field_name
+
+        ### Selected Options Sanity Check ###
+        # print("%s Selected Options Sanity Check" % hook_field_name)
+
+        if not BasicHook.checkObj(
+            obj,
+            hook_field_name,
+            ("code",),
+            error=error
+        ):
+            return None
+
+        ### Hook Initialization ###
+
+        hook = AsmHook()
+
+        ### Read Base Options ###
+
+        if not hook.baseFromObj(obj, hook_field_name, error):
+            return None
+
+        for address in hook.address:
+            if address & 3 != 0:
+                error("In %s, expected value in \"addr\" [0x%08X] to be aligned by %d" % (hook_field_name, address, 4))
+                return None
+
+        ### Code Reading ###
+
+        if "code" not in obj:
+            error("%s Code not specified" % hook_field_name)
+            return None
+
+        code = obj["code"]
+        if isinstance(code, list) and code and all(isinstance(line, str) for line in code):
+            code = '\n'.join(code)
+        elif not isinstance(code, str):
+            error("In %s, expected \"code\" to be a string or a non-empty list of strings" % hook_field_name)
+            return None
+
+        code = proj.processString("%s Code" % hook_field_name, code, error=error)
+        if code is None:
+            return None
+
+        try:
+            program = AsmProgram.parse(code)
+            for address in hook.address:
+                program.check(address)
+
+        except AsmError as e:
+            error("In %s, invalid assembly: %s" % (hook_field_name, e))
+            return None
+
+        hook.program = program
+
+        ### Success ###
+
+        return hook
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Columnar hooks - All hooks of a target flattened to one row per (hook, address),
+# so that branch and function pointer data can be computed for every row at once
+
+
+# Built-in
+from array import array
+import sys
+
+
+# Local
+from .hook import BranchHook
+from .hook import FillHook
+from .hook import FuncPtrHook
+from .hook import NOPHook
+from .hook import PatchHook
+from .hook import ReturnHook
+from .patch import FillData
+
+
+HOOK_KIND_DATA          = 0  # Same data at every address, independent of symbols
+HOOK_KIND_BRANCH        = 1
+HOOK_KIND_BRANCH_LINK   = 2
+HOOK_KIND_FUNCPTR       = 3
+HOOK_KIND_OTHER         = 4  # Encoded by the hook itself, per address
+
+HOOK_DATA_TYPES = (PatchHook, NOPHook, FillHook, ReturnHook)
+
+NO_SYMBOL = -1
+
+
+class HookColumns:
+    """
+    Notes:
+    * Every column has one entry per row; rows are in module, hook, address order.
+    * 'symbolIndices' indexes 'symbols' for branch and function pointer rows, and is NO_SYMBOL otherwise.
+    * 'hookIndices' indexes 'hooks'.
+    """
+
+    # (module, resolve) -> Converted address list of each hook of the module
+    # Modules and address conversion maps are loaded once per file and shared across targets,
+    # so targets using the same map and modules only look up their converted addresses.
+    # A changed map is a new object, and never matches the entries of the old one.
+    addressCache = {}
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.addresses = array('I')
+        self.symbolIndices = array('i')
+        self.hookIndices = array('I')
+
+        self.hooks = []
+        self.symbols = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @staticmethod
+    def fromModules(modules, resolve=None):
+        """
+        Flattens the hooks of 'modules', converting their addresses with 'resolve' (if given).
+        """
+
+        columns = HookColumns()
+
+        # Gathered in lists first, which are faster to grow than arrays
+        kinds = []
+        addresses = []
+        symbol_indices = []
+        hook_indices = []
+
+        hooks = columns.hooks
+        symbols = columns.symbols
+        symbol_map = {}
+
+        address_cache = HookColumns.addressCache
+
+        for module in modules:
+            module_addresses = None
+            if resolve is not None:
+                key = (module, resolve)
+                module_addresses = address_cache.get(key)
+                if module_addresses is None:
+                    module_addresses = [[resolve(address) for address in hook.address] for hook in module.hooks]
+                    address_cache[key] = module_addresses
+
+            for i, hook in enumerate(module.hooks):
+                hook_type = type(hook)
+                symbol_index = NO_SYMBOL
+
+                if hook_type in HOOK_DATA_TYPES:
+                    kind = HOOK_KIND_DATA
+
+                elif hook_type is BranchHook or hook_type is FuncPtrHook:
+                    if hook_type is FuncPtrHook:
+                        kind = HOOK_KIND_FUNCPTR
+                    elif hook.type == BranchHook.Type.Branch_Link:
+                        kind = HOOK_KIND_BRANCH_LINK
+                    else:
+                        kind = HOOK_KIND_BRANCH
+
+                    symbol_index = symbol_map.get(hook.func)
+                    if symbol_index is None:
+                        symbol_index = symbol_map[hook.func] = len(symbols)
+                        symbols.append(hook.func)
+
+                else:
+                    kind = HOOK_KIND_OTHER
+
+                hook_address = hook.address if module_addresses is None else module_addresses[i]
+
+                count = len(hook_address)
+
+                kinds += [kind] * count
+                addresses += hook_address
+                symbol_indices += [symbol_index] * count
+                hook_indices += [len(hooks)] * count
+
+                hooks.append(hook)
+
+        columns.kinds = array('B', kinds)
+        columns.addresses = array('I', addresses)
+        columns.symbolIndices = array('i', symbol_indices)
+        columns.hookIndices = array('I', hook_indices)
+
+        return columns
+
+    def generatePatches(self, symbols):
+        """
+        Yields (address, data, hook) for every row, in order, as consumed by clpc.patchgen.consumePatches.
+
+        Notes:
+        * 'symbols' must map every symbol of the hooks as written, i.e., be the result of clpc.hook.resolveSymbols.
+        * Rows are grouped by hook, so only the data of the current data hook is held, and it is dropped
+          once that hook's last row has been yielded. Whether the patch set is kept in memory past that
+          is up to the sinks (see clpc.patchgen).
+        """
+
+        kinds = self.kinds
+        addresses = self.addresses
+        symbol_indices = self.symbolIndices
+        hook_indices = self.hookIndices
+        hooks = self.hooks
+
+        symbol_values = array('I', map(symbols.__getitem__, self.symbols))
+
+        # Branch instructions and function pointers of all rows are computed at once,
+        # and converted to big-endian in a single buffer that rows slice into
+        words = array('I', [
+            0x48000000 | ((symbol_values[symbol_index] - address) & 0x03FFFFFC) | (kind == HOOK_KIND_BRANCH_LINK)
+            if kind != HOOK_KIND_FUNCPTR else symbol_values[symbol_index]
+            for kind, address, symbol_index in zip(kinds, addresses, symbol_indices)
+            if symbol_index != NO_SYMBOL
+        ])
+
+        if sys.byteorder == "little":
+            words.byteswap()
+
+        words_view = memoryview(words.tobytes())
+        word_pos = 0
+
+        data_hook_index = -1
+        hook_data = None
+
+        for kind, address, hook_index in zip(kinds, addresses, hook_indices):
+            hook = hooks[hook_index]
+
+            if hook_index != data_hook_index:
+                # The rows of the previous hook are done
+                data_hook_index = hook_index
+                hook_data = None
+
+            if kind == HOOK_KIND_DATA:
+                if hook_data is None:
+                    # Repeated patterns are passed on unexpanded, see clpc.patch.FillData
+                    fill = hook.getFill()
+                    if fill is not None and fill[1] > 1:
+                        hook_data = FillData(*fill)
+                    else:
+                        hook_data = hook.getData(address, symbols)
+
+                data = hook_data
+
+            elif kind == HOOK_KIND_OTHER:
+                data = hook.getData(address, symbols)
+
+            else:
+                data = words_view[word_pos:word_pos + 4]
+                word_pos += 4
+
+            yield address, data, hook
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Hook tables - Bulk hooks loaded from external CSV or binary files, kept in columns
+#
+# CSV format:
+#   A header row naming the columns "type", "addr", "symbol" and "data" (in any order; "symbol" and "data" are optional),
+#   followed by one hook per row.
+#
+# Binary format (big-endian):
+#   Header (0x18 bytes):
+#     char[4] magic ("HTBL"), u16 version (1), u16 header size,
+#     u32 row count, u32 rows offset, u32 strings offset, u32 data offset
+#   Rows (0x14 bytes each):
+#     u8 type, 3 reserved bytes, u32 address, u32 symbol offset (relative to the strings, 0xFFFFFFFF -> none),
+#     u32 data offset (relative to the data), u32 data size
+#   Strings:
+#     Null-terminated UTF-8 symbol names
+#   Data:
+#     Raw patch data
+#
+# Row types and the columns they use:
+#   patch:   data (hex string in CSV, raw bytes in binary)
+#   nop:     data (NOP count; empty -> 1) - In the binary format, the count is stored as the data size, with no data
+#   return:  -
+#   b, bl:   symbol (branch target)
+#   funcptr: symbol
+
+
+# Built-in
+from array import array
+import csv
+import os
+import struct
+import sys
+
+
+# Local
+from .hook import ARRAY_TYPECODE_U32
+from .hook import BranchHook
+from .hook import FuncPtrHook
+from .hook import HOOK_DATA_MAX_SIZE
+from .hook import NOP_MAX_COUNT
+from .hook import NOPHook
+from .hook import PatchHook
+from .hook import ReturnHook
+
+
+HOOK_TABLE_MAGIC = b"HTBL"
+HOOK_TABLE_VERSION = 1
+
+HOOK_TABLE_HEADER_STRUCT = struct.Struct(">4sHHIIII")
+HOOK_TABLE_ROW_SIZE = 0x14
+
+HOOK_TABLE_NO_SYMBOL = 0xFFFFFFFF
+
+HOOK_TABLE_TYPE_PATCH   = 0
+HOOK_TABLE_TYPE_NOP     = 1
+HOOK_TABLE_TYPE_RETURN  = 2
+HOOK_TABLE_TYPE_B       = 3
+HOOK_TABLE_TYPE_BL      = 4
+HOOK_TABLE_TYPE_FUNCPTR = 5
+
+HOOK_TABLE_TYPES = {
+    "patch":    HOOK_TABLE_TYPE_PATCH,
+    "nop":      HOOK_TABLE_TYPE_NOP,
+    "return":   HOOK_TABLE_TYPE_RETURN,
+    "b":        HOOK_TABLE_TYPE_B,
+    "bl":       HOOK_TABLE_TYPE_BL,
+    "funcptr":  HOOK_TABLE_TYPE_FUNCPTR
+}
+
+# Types which patch instructions or pointers, and must be 4-byte aligned
+HOOK_TABLE_ALIGNED_TYPES = (
+    HOOK_TABLE_TYPE_NOP,
+    HOOK_TABLE_TYPE_RETURN,
+    HOOK_TABLE_TYPE_B,
+    HOOK_TABLE_TYPE_BL,
+    HOOK_TABLE_TYPE_FUNCPTR
+)
+
+HOOK_TABLE_SYMBOL_TYPES = (
+    HOOK_TABLE_TYPE_B,
+    HOOK_TABLE_TYPE_BL,
+    HOOK_TABLE_TYPE_FUNCPTR
+)
+
+
+class HookTable:
+    """
+    Hooks of a table, stored as columns (one entry per row).
+
+    Notes:
+    * 'data' holds the patch data of patch rows, the NOP count of nop rows and None otherwise.
+    * 'symbols' holds the symbol of branch and function pointer rows and None otherwise.
+    """
+
+    def __init__(self):
+        self.types = array('B')
+        self.addresses = array(ARRAY_TYPECODE_U32)
+        self.symbols = []
+        self.data = []
+
+    def __len__(self):
+        return len(self.types)
+
+    def check(self, table_field_name, error=print):
+        types = self.types
+        addresses = self.addresses
+
+        type_values = set(types)
+        if not type_values.issubset(HOOK_TABLE_TYPES.values()):
+            error("In %s, unknown hook type(s): %s" % (table_field_name, ', '.join(map(str, sorted(type_values - set(HOOK_TABLE_TYPES.values()))))))
+            return False
+
+        aligned_types = HOOK_TABLE_ALIGNED_TYPES
+        misaligned = [i for i, address in enumerate(addresses) if address & 3 and types[i] in aligned_types]
+        if misaligned:
+            i = misaligned[0]
+            error("In %s, expected address of row %d [0x%08X] to be aligned by 4 (%d misaligned row(s) in total)" % (table_field_name, i, addresses[i], len(misaligned)))
+            return False
+
+        symbol_types = HOOK_TABLE_SYMBOL_TYPES
+        missing = [i for i, (type_, symbol) in enumerate(zip(types, self.symbols)) if type_ in symbol_types and not symbol]
+        if missing:
+            error("In %s, symbol not specified in row %d (%d row(s) in total)" % (table_field_name, missing[0], len(missing)))
+            return False
+
+        empty = [i for i, (type_, data) in enumerate(zip(types, self.data)) if type_ == HOOK_TABLE_TYPE_PATCH and not data]
+        if empty:
+            error("In %s, data not specified in row %d (%d row(s) in total)" % (table_field_name, empty[0], len(empty)))
+            return False
+
+        # Same limits as the NOP and patch hooks of modules
+        too_large = [
+            i for i, (type_, data) in enumerate(zip(types, self.data))
+            if (type_ == HOOK_TABLE_TYPE_NOP and not 0 < data <= NOP_MAX_COUNT) or
+               (type_ == HOOK_TABLE_TYPE_PATCH and len(data) > HOOK_DATA_MAX_SIZE)
+        ]
+        if too_large:
+            error("In %s, NOP count or patch data size out of range in row %d (NOP count: [1, %d], patch data: at most 0x%X bytes; %d row(s) in total)" % (table_field_name, too_large[0], NOP_MAX_COUNT, HOOK_DATA_MAX_SIZE, len(too_large)))
+            return False
+
+        return True
+
+    def toHooks(self):
+        """
+        Creates the hook objects of this table.
+        Rows with the same type and data (or symbol) become a single hook with several addresses.
+        """
+
+        groups = {}
+        for type_, address, symbol, data in zip(self.types, self.addresses, self.symbols, self.data):
+            key = (type_, symbol, data)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [address]
+            else:
+                group.append(address)
+
+        hooks = []
+
+        for (type_, symbol, data), addresses in groups.items():
+            if type_ == HOOK_TABLE_TYPE_PATCH:
+                hook = PatchHook()
+                hook.dataCache = data  # Already raw bytes
+
+            elif type_ == HOOK_TABLE_TYPE_NOP:
+                hook = NOPHook()
+                hook.count = data
+
+            elif type_ == HOOK_TABLE_TYPE_RETURN:
+                hook = ReturnHook()
+
+            elif type_ == HOOK_TABLE_TYPE_FUNCPTR:
+                hook = FuncPtrHook()
+                hook.func = symbol
+
+            else:
+                hook = BranchHook()
+                hook.type = BranchHook.Type.Branch_Link if type_ == HOOK_TABLE_TYPE_BL else BranchHook.Type.Branch
+                hook.func = symbol
+
+            hook.address = addresses
+            hooks.append(hook)
+
+        return hooks
+
+    @staticmethod
+    def fromCsv(file, table_field_name, proj, error=print):
+        with open(file, newline='', encoding="utf8") as inf:
+            reader = csv.reader(inf)
+
+            header = next(reader, None)
+            if header is None:
+                error("In %s, missing header row" % table_field_name)
+                return None
+
+            header = [column.strip().lower() for column in header]
+            for column in header:
+                if column not in ("type", "addr", "symbol", "data"):
+                    error("In %s, unrecognized column: %r" % (table_field_name, column))
+                    return None
+
+            if "type" not in header or "addr" not in header:
+                error("In %s, expected the \"type\" and \"addr\" columns" % table_field_name)
+                return None
+
+            rows = [row for row in reader if row]
+
+        table = HookTable()
+        row_count = len(rows)
+
+        def column(name):
+            if name not in header:
+                return [''] * row_count
+
+            i = header.index(name)
+            return [row[i].strip() if i < len(row) else '' for row in rows]
+
+        # Strings repeat across rows, so each distinct one is processed once
+        def processColumn(name):
+            processed = {}
+            values = []
+            for i, s in enumerate(column(name)):
+                value = processed.get(s)
+                if value is None:
+                    value = proj.processString("%s Row %d %s" % (table_field_name, i, name.capitalize()), s, allow_empty=True, error=error)
+                    if value is None:
+                        return None
+
+                    processed[s] = value
+
+                values.append(value)
+
+            return values
+
+        type_strs = processColumn("type")
+        if type_strs is None:
+            return None
+
+        try:
+            table.types = array('B', (HOOK_TABLE_TYPES[s.lower()] for s in type_strs))
+        except KeyError as e:
+            error("In %s, invalid hook type: %s" % (table_field_name, e))
+            return None
+
+        symbol_strs = processColumn("symbol")
+        if symbol_strs is None:
+            return None
+
+        try:
+            table.addresses = array(ARRAY_TYPECODE_U32, (int(s, 0) for s in column("addr")))
+        except (ValueError, OverflowError):
+            error("In %s, expected every address to be an unsigned 32-bit integer" % table_field_name)
+            return None
+
+        table.symbols = [symbol if type_ in HOOK_TABLE_SYMBOL_TYPES else None for type_, symbol in zip(table.types, symbol_strs)]
+
+        data_lst = []
+        for i, (type_, data_str) in enumerate(zip(table.types, column("data"))):
+            try:
+                if type_ == HOOK_TABLE_TYPE_PATCH:
+                    data = bytes.fromhex(data_str)
+                elif type_ == HOOK_TABLE_TYPE_NOP:
+                    data = int(data_str, 0) if data_str else 1
+                    if data <= 0:
+                        raise ValueError
+                else:
+                    data = None
+
+            except ValueError:
+                error("In %s, invalid data in row %d: %r" % (table_field_name, i, data_str))
+                return None
+
+            data_lst.append(data)
+
+        table.data = data_lst
+        return table
+
+    @staticmethod
+    def fromBinary(data, table_field_name, error=print):
+        if len(data) < HOOK_TABLE_HEADER_STRUCT.size:
+            error("In %s, unexpected end of data" % table_field_name)
+            return None
+
+        magic, version, _, count, rows_offset, strings_offset, data_offset = HOOK_TABLE_HEADER_STRUCT.unpack_from(data, 0)
+        if magic != HOOK_TABLE_MAGIC or version != HOOK_TABLE_VERSION:
+            error("In %s, unsupported hook table format" % table_field_name)
+            return None
+
+        rows_end = rows_offset + count * HOOK_TABLE_ROW_SIZE
+        if rows_end > len(data) or strings_offset > len(data) or data_offset > len(data):
+            error("In %s, unexpected end of data" % table_field_name)
+            return None
+
+        # All rows are read at once as big-endian words, and split into columns by slicing
+        words = array(ARRAY_TYPECODE_U32, data[rows_offset:rows_end])
+        if sys.byteorder == "little":
+            words.byteswap()
+
+        table = HookTable()
+        table.types = array('B', (word >> 24 for word in words[0::5]))
+        table.addresses = words[1::5]
+
+        strings = data[strings_offset:data_offset]
+        payload = data[data_offset:]
+
+        symbol_cache = {}
+        symbols = []
+        for type_, offset in zip(table.types, words[2::5]):
+            if offset == HOOK_TABLE_NO_SYMBOL or type_ not in HOOK_TABLE_SYMBOL_TYPES:
+                symbols.append(None)
+                continue
+
+            symbol = symbol_cache.get(offset)
+            if symbol is None:
+                end = strings.find(b'\0', offset)
+                if end == -1:
+                    error("In %s, unterminated symbol name at 0x%X" % (table_field_name, offset))
+                    return None
+
+                symbol = symbol_cache[offset] = strings[offset:end].decode("utf-8")
+
+            symbols.append(symbol)
+
+        data_lst = []
+        for type_, offset, size in zip(table.types, words[3::5], words[4::5]):
+            if type_ == HOOK_TABLE_TYPE_PATCH:
+                if offset + size > len(payload):
+                    error("In %s, patch data exceeds the data at 0x%X" % (table_field_name, offset))
+                    return None
+
+                data_lst.append(bytes(payload[offset:offset + size]))
+
+            elif type_ == HOOK_TABLE_TYPE_NOP:
+                data_lst.append(size or 1)
+
+            else:
+                data_lst.append(None)
+
+        table.symbols = symbols
+        table.data = data_lst
+        return table
+
+    def saveBinary(self):
+        strings = bytearray()
+        string_offsets = {}
+
+        payload = bytearray()
+        payload_offsets = {}
+
+        words = array(ARRAY_TYPECODE_U32)
+
+        for type_, address, symbol, data in zip(self.types, self.addresses, self.symbols, self.data):
+            symbol_offset = HOOK_TABLE_NO_SYMBOL
+            if symbol is not None:
+                symbol_offset = string_offsets.get(symbol)
+                if symbol_offset is None:
+                    symbol_offset = string_offsets[symbol] = len(strings)
+                    strings += symbol.encode("utf-8") + b'\0'
+
+            data_offset = 0
+            data_size = 0
+            if type_ == HOOK_TABLE_TYPE_PATCH:
+                data_offset = payload_offsets.get(data)
+                if data_offset is None:
+                    data_offset = payload_offsets[data] = len(payload)
+                    payload += data
+
+                data_size = len(data)
+
+            elif type_ == HOOK_TABLE_TYPE_NOP:
+                data_size = data
+
+            words.extend((type_ << 24, address, symbol_offset, data_offset, data_size))
+
+        if sys.byteorder == "little":
+            words.byteswap()
+
+        header_size = HOOK_TABLE_HEADER_STRUCT.size
+        rows_offset = header_size
+        strings_offset = rows_offset + len(self) * HOOK_TABLE_ROW_SIZE
+        data_offset = strings_offset + len(strings)
+
+        return b''.join((
+            HOOK_TABLE_HEADER_STRUCT.pack(HOOK_TABLE_MAGIC, HOOK_TABLE_VERSION, header_size, len(self), rows_offset, strings_offset, data_offset),
+            words.tobytes(),
+            strings,
+            payload
+        ))
+
+    @staticmethod
+    def fromFile(file, table_field_name, proj, error=print):
+        if not os.path.isfile(file):
+            error("In %s, file does not exist: %r" % (table_field_name, str(file)))
+            return None
+
+        if os.path.splitext(file)[1].lower() == ".csv":
+            table = HookTable.fromCsv(file, table_field_name, proj, error)
+
+        else:
+            with open(file, "rb") as inf:
+                table = HookTable.fromBinary(inf.read(), table_field_name, error)
+
+        if table is None or not table.check(table_field_name, error):
+            return None
+
+        return table
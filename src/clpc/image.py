@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Built-in
+import hashlib
+import os
+import pickle
+import threading
+
+
+# Local
+from .elf import ELF
+from .index import getRelocationOffsets
+from .index import RelocationIndex
+from .index import SectionIndex
+from .overlay import ELFOverlay
+from .rpx import RPX
+
+
+class BaseImage:
+    """
+    Decompressed base RPX, cached by the RPX content hash.
+    The cache is kept both in memory (shared across targets) and on disk (shared across builds).
+
+    Notes:
+    * Besides the image, the disk cache holds the section table and relocation offset indices used when patching,
+      so that a cached image is only split into sections, and its relocations are never parsed.
+    * Only the CACHE_MAX_ENTRIES most recently used cache files are kept on disk.
+    """
+
+    CACHE_VERSION = 2
+    CACHE_MAX_ENTRIES = 8
+
+    memoryCache = {}
+    hashCache = {}
+
+    def __init__(self):
+        self.hash = None
+        self.rpx = None
+
+        self.data = None  # Uncompressed ELF image
+
+        self.textEnd = 0x02000000
+        self.dataEnd = 0x10000000
+        self.dynaEnd = 0xC0000000
+
+        self.sectionTable = []  # (start, end, section index, relocation section index or None) per loaded section, sorted by start
+        self.relocationIndices = {}  # Relocation section index -> RelocationIndex
+
+        self.elf = None
+        self.elfLock = threading.Lock()
+
+        self.sectionIndex = None
+
+    def createELF(self):
+        return ELF(self.data, lazy_relocations=True)
+
+    def getELF(self):
+        """
+        Returns the parsed base ELF, which is shared and must be treated as read-only.
+        """
+
+        with self.elfLock:
+            if self.elf is None:
+                self.elf = self.createELF()
+
+            return self.elf
+
+    def getRelocationIndex(self, entry):
+        """
+        Returns the (shared) offset index of relocation section 'entry' of the base ELF.
+        """
+
+        elf = self.getELF()
+        i = elf.secHeadEnts.index(entry)
+
+        with self.elfLock:
+            if i not in self.relocationIndices:
+                self.relocationIndices[i] = RelocationIndex(getRelocationOffsets(entry, elf.header.endian))
+
+            return self.relocationIndices[i]
+
+    def getSectionIndex(self):
+        """
+        Returns the (shared) address-space index of the base ELF sections.
+        """
+
+        section_headers = self.getELF().secHeadEnts
+
+        with self.elfLock:
+            if self.sectionIndex is None:
+                self.sectionIndex = SectionIndex([
+                    (start, end, section_headers[i], None if rela_i is None else section_headers[rela_i])
+                    for start, end, i, rela_i in self.sectionTable
+                ])
+
+            return self.sectionIndex
+
+    def createOverlay(self):
+        return ELFOverlay(self.getELF())
+
+    def fromELF(self, elf):
+        section_headers = elf.secHeadEnts
+
+        self.textEnd = max((entry.vAddr + entry.size_ for entry in section_headers if 0x02000000 <= entry.vAddr < 0x10000000), default=0x02000000)
+        self.dataEnd = max((entry.vAddr + entry.size_ for entry in section_headers if 0x10000000 <= entry.vAddr < 0xC0000000), default=0x10000000)
+        self.dynaEnd = max((entry.vAddr + entry.size_ for entry in section_headers if 0xC0000000 <= entry.vAddr < 0xC8000000), default=0xC0000000)
+
+        section_indices = {entry: i for i, entry in enumerate(section_headers)}
+
+        self.sectionTable = [
+            (start, end, section_indices[entry], None if entry_rela is None else section_indices[entry_rela])
+            for start, end, entry, entry_rela in SectionIndex.fromELF(elf).ranges
+        ]
+
+        self.relocationIndices = {
+            rela_i: RelocationIndex(getRelocationOffsets(section_headers[rela_i], elf.header.endian))
+            for _, _, _, rela_i in self.sectionTable
+            if rela_i is not None
+        }
+
+    def save(self, file):
+        obj = {
+            "version":              BaseImage.CACHE_VERSION,
+            "hash":                 self.hash,
+            "data":                 bytes(self.data),
+            "textEnd":              self.textEnd,
+            "dataEnd":              self.dataEnd,
+            "dynaEnd":              self.dynaEnd,
+            "sectionTable":         self.sectionTable,
+            "relocationIndices":    self.relocationIndices
+        }
+
+        with open(file, "wb") as outf:
+            pickle.dump(obj, outf, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, file):
+        try:
+            with open(file, "rb") as inf:
+                obj = pickle.load(inf)
+
+        except Exception:
+            return False
+
+        if not isinstance(obj, dict) or \
+           obj.get("version") != BaseImage.CACHE_VERSION or \
+           obj.get("hash") != self.hash:
+            return False
+
+        self.data = obj["data"]
+        self.textEnd = obj["textEnd"]
+        self.dataEnd = obj["dataEnd"]
+        self.dynaEnd = obj["dynaEnd"]
+        self.sectionTable = obj["sectionTable"]
+        self.relocationIndices = obj["relocationIndices"]
+
+        return True
+
+    @staticmethod
+    def pruneCache(cache_dir):
+        """
+        Removes all but the BaseImage.CACHE_MAX_ENTRIES most recently used cache files in 'cache_dir'.
+        """
+
+        cache_files = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".cache"):
+                path = os.path.join(cache_dir, name)
+                try:
+                    cache_files.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+
+        cache_files.sort(reverse=True)
+
+        for _, path in cache_files[BaseImage.CACHE_MAX_ENTRIES:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def fromFile(rpx_path, cache_dir=None):
+        rpx = RPX(rpx_path)
+
+        stat = os.stat(rpx_path)
+        hash_key = (os.path.normcase(os.path.abspath(rpx_path)), stat.st_size, stat.st_mtime_ns)
+
+        hash_cache = BaseImage.hashCache
+        if hash_key in hash_cache:
+            hash_ = hash_cache[hash_key]
+
+        else:
+            hash_ = hashlib.sha1(rpx.data).hexdigest()
+            hash_cache[hash_key] = hash_
+
+        memory_cache = BaseImage.memoryCache
+        if hash_ in memory_cache:
+            # print("Already cached: %s" % rpx_path)
+            return memory_cache[hash_]
+
+        image = BaseImage()
+        image.hash = hash_
+        image.rpx = rpx
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, "%s.cache" % hash_)
+
+        if cache_path is not None and image.load(cache_path):
+            # Marks the cache file as recently used
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+
+        else:
+            image.data = rpx.decompress()
+            image.fromELF(image.getELF())
+
+            if cache_path is not None:
+                image.save(cache_path)
+                BaseImage.pruneCache(cache_dir)
+
+        memory_cache[hash_] = image
+        return image
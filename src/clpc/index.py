@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Built-in
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+import struct
+
+
+def getRelocationOffsets(entry, endian):
+    """
+    Returns the offset of every relocation of relocation section 'entry', read straight from its data
+    (i.e., without parsing the relocations).
+    """
+
+    offset_format = 'I' if entry.entSize == 0xC else 'Q'
+    offset_struct = struct.Struct("%s%s%dx" % (endian, offset_format, entry.entSize - struct.calcsize(offset_format)))
+
+    return array(offset_format, (offset for (offset,) in offset_struct.iter_unpack(entry.data)))
+
+
+class RelocationIndex:
+    """
+    Relocations of a (read-only) relocation section, sorted by offset.
+    Looking up the relocations inside an address range costs O(log n).
+    """
+
+    def __init__(self, offsets):
+        # Relocations are usually already sorted by offset in RPL files
+        if all(a <= b for a, b in zip(offsets, offsets[1:])):
+            self.order = range(len(offsets))
+            self.offsets = offsets
+
+        else:
+            self.order = sorted(range(len(offsets)), key=offsets.__getitem__)
+            self.offsets = [offsets[i] for i in self.order]
+
+    def find(self, start, end):
+        """
+        Returns the indices (in the relocation section) of the relocations with offset in range [start, end).
+        """
+
+        offsets = self.offsets
+
+        lo = bisect_left(offsets, start)
+        hi = bisect_left(offsets, end, lo)
+
+        return self.order[lo:hi]
+
+
+class SectionIndex:
+    """
+    Address-space index of the loaded sections of a (read-only) ELF.
+    Looking up the section containing an address costs O(log n).
+    """
+
+    def __init__(self, ranges):
+        # 'ranges' is a list of (start, end, section, relocation section), sorted by start
+        self.starts = [start for start, _, _, _ in ranges]
+        self.ranges = ranges
+
+    @staticmethod
+    def fromELF(elf):
+        section_headers = elf.secHeadEnts
+
+        relas = {}
+        for entry in section_headers:
+            if entry.type == 4 and 0 < entry.info < len(section_headers):
+                relas[section_headers[entry.info]] = entry
+
+        ranges = sorted(
+            (
+                (entry.vAddr, entry.vAddr + entry.size_, entry)
+                for entry in section_headers
+                if entry.flags & 2 and entry.size_ > 0  # SHF_ALLOC
+            ),
+            key=lambda e: e[0]  # Sections are not comparable
+        )
+
+        return SectionIndex([(start, end, entry, relas.get(entry)) for start, end, entry in ranges])
+
+    def find(self, address):
+        """
+        Returns (section, relocation section, start, end) of the section containing 'address', or None.
+        """
+
+        i = bisect_right(self.starts, address) - 1
+        if i < 0:
+            return None
+
+        start, end, entry, entry_rela = self.ranges[i]
+        if address >= end:
+            return None
+
+        return entry, entry_rela, start, end
+
+    def findNearest(self, address):
+        """
+        Returns (section, relocation section, start, end) of the closest section starting at or before 'address', or None.
+        """
+
+        i = bisect_right(self.starts, address) - 1
+        if i < 0:
+            return None
+
+        start, end, entry, entry_rela = self.ranges[i]
+        return entry, entry_rela, start, end
@@ -10,11 +10,15 @@ import os
 # Local
 from .common import IsValidFilename
 from .common import NormalizePath
+from .hook import AsmHook
 from .hook import BranchHook
+from .hook import FillHook
+from .hook import FuncPtrArrayHook
 from .hook import FuncPtrHook
 from .hook import NOPHook
 from .hook import PatchHook
 from .hook import ReturnHook
+from .hookTable import HookTable
 
 
 # External
@@ -150,7 +154,8 @@ class Module:
         available_options = (
             "Align",
             "Files",
-            "Hooks"
+            "Hooks",
+            "HookTables"
         )
 
         available_options_error_msg = "Unrecognized option in %s: %s" % (module_field_name, "%r")
@@ -250,7 +255,7 @@ class Module:
                         return None
 
                     if type_ == "patch":
-                        hook = PatchHook.fromObj(hook_obj, module_field_name, proj, error)
+                        hook = PatchHook.fromObj(hook_obj, module_field_name, proj, error, module.path)
                         if hook is None:
                             return None
 
@@ -259,6 +264,11 @@ class Module:
                         if hook is None:
                             return None
 
+                    elif type_ == "fill":
+                        hook = FillHook.fromObj(hook_obj, module_field_name, proj, error)
+                        if hook is None:
+                            return None
+
                     elif type_ == "return":
                         hook = ReturnHook.fromObj(hook_obj, module_field_name, proj, error)
                         if hook is None:
@@ -274,6 +284,16 @@ class Module:
                         if hook is None:
                             return None
 
+                    elif type_ == "funcptr[]":
+                        hook = FuncPtrArrayHook.fromObj(hook_obj, module_field_name, proj, error)
+                        if hook is None:
+                            return None
+
+                    elif type_ == "asm":
+                        hook = AsmHook.fromObj(hook_obj, module_field_name, proj, error)
+                        if hook is None:
+                            return None
+
                     else:
                         error(hook_type_error_msg)
                         return None
@@ -282,6 +302,34 @@ class Module:
 
                 module.hooks = hooks_new
 
+        ### Hook Tables Reading ###
+        # print("%s Hook Tables Reading" % module_field_name)
+
+        if "HookTables" in obj:
+            tables = obj["HookTables"]
+            if tables is not None:
+                if not isinstance(tables, list):
+                    error("In %s, expected \"HookTables\" to be a list of strings" % module_field_name)
+                    return None
+
+                tables_field_name = "\"HookTables\" in %s" % module_field_name
+
+                for table_path in tables:
+                    base_table_path = table_path
+
+                    table_path = proj.processString(tables_field_name, table_path, error=error)
+                    if table_path is None:
+                        return None
+
+                    if not os.path.isabs(table_path):
+                        table_path = os.path.join(module.path, table_path)
+
+                    table = HookTable.fromFile(NormalizePath(table_path), "%s Hook Table %r" % (module_field_name, base_table_path), proj, error)
+                    if table is None:
+                        return None
+
+                    module.hooks.extend(table.toHooks())
+
         ### Success ###
         # print("%s Success" % module_field_name)
 
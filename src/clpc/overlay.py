@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Built-in
+import struct
+
+
+# Local
+from .common import align
+from .rpx import saveRpx
+from .rpx import ZLIB_LEVEL_DEFAULT
+
+
+class ELFOverlay:
+    """
+    Copy-on-write view over a read-only base ELF.
+
+    Section appends/removals, byte patches, relocation removals and data replacements are recorded
+    and only materialized when the data is requested, so that the base ELF is never modified and can
+    be shared between (concurrent) builds.
+
+    Notes:
+    * Sections that do not belong to the base ELF (i.e., appended ones) are owned by the caller,
+      and are used as-is.
+    """
+
+    class Section(struct.Struct):
+        def __init__(self, entry, data):
+            super().__init__(entry.format)
+
+            self.nameIdx    = entry.nameIdx
+            self.type       = entry.type
+            self.flags      = entry.flags
+            self.vAddr      = entry.vAddr
+            self.size_      = len(data)
+            self.link       = entry.link
+            self.info       = entry.info
+            self.addrAlign  = entry.addrAlign
+            self.entSize    = entry.entSize
+
+            self.name = entry.name
+            self.data = data
+
+        def save(self, offset):
+            if self.type == 8:
+                offset = 0
+
+            return struct.pack(
+                self.format,
+                self.nameIdx,
+                self.type,
+                self.flags,
+                self.vAddr,
+                offset,
+                len(self.data),
+                self.link,
+                self.info,
+                self.addrAlign,
+                self.entSize
+            )
+
+    def __init__(self, base):
+        self.base = base
+        self.header = base.header
+        self.shStrTable = base.shStrTable
+
+        # The overlay's own section list; the base list is never modified
+        self.secHeadEnts = list(base.secHeadEnts)
+
+        self.baseEntries = set(base.secHeadEnts)
+
+        self.patches = {}
+        self.removedRelocations = {}
+        self.replacedData = {}
+
+        self.dataCache = {}
+
+    def getSectionByName(self, name):
+        for entry in self.secHeadEnts:
+            if entry.name == name:
+                return entry
+
+        return None
+
+    def isBase(self, entry):
+        return entry in self.baseEntries
+
+    def isModified(self, entry):
+        return entry in self.patches or \
+               entry in self.removedRelocations or \
+               entry in self.replacedData or \
+               not self.isBase(entry)
+
+    def patch(self, entry, offset, data):
+        assert self.isBase(entry)
+        assert 0 <= offset and offset + len(data) <= len(entry.data)
+
+        self.patches.setdefault(entry, []).append((offset, data))
+        self.dataCache.pop(entry, None)
+
+    def removeRelocations(self, entry, indices):
+        assert self.isBase(entry) and entry.type == 4
+
+        if not indices:
+            return
+
+        self.removedRelocations.setdefault(entry, set()).update(indices)
+        self.dataCache.pop(entry, None)
+
+    def setData(self, entry, data):
+        self.replacedData[entry] = data
+        self.dataCache.pop(entry, None)
+
+    def getData(self, entry):
+        if entry in self.replacedData:
+            return self.replacedData[entry]
+
+        if not self.isBase(entry):
+            if entry.type == 4:
+                entry.saveRela()
+
+            return entry.data
+
+        if entry in self.dataCache:
+            return self.dataCache[entry]
+
+        if entry in self.removedRelocations:
+            # Base relocations are never modified, so their entries are copied from the section data as-is
+            removed = self.removedRelocations[entry]
+            entry_data = entry.data
+            ent_size = entry.entSize
+            data = bytearray(b''.join([
+                entry_data[pos:pos + ent_size]
+                for i, pos in enumerate(range(0, len(entry_data), ent_size))
+                if i not in removed
+            ]))
+
+        elif entry in self.patches:
+            data = bytearray(entry.data)
+            for offset, patch_data in self.patches[entry]:
+                data[offset:offset + len(patch_data)] = patch_data
+
+        else:
+            return entry.data
+
+        self.dataCache[entry] = data
+        return data
+
+    def materialize(self):
+        return [ELFOverlay.Section(entry, self.getData(entry)) for entry in self.secHeadEnts]
+
+    def save(self):
+        # The base header is shared and read-only; RPL files already have the 0xFE01 type set
+        sections = self.materialize()
+        sh_str_idx = self.secHeadEnts.index(self.shStrTable)
+
+        outBuffer = bytearray(self.header.save(sections, sh_str_idx))
+
+        padSize = align(len(outBuffer), 0x10) - len(outBuffer)
+        outBuffer += b'\0' * padSize
+
+        offset = self.header.size + self.header.ident.size + padSize + len(sections) * sections[0].size
+        outBuffer += sections[0].save(0)
+        for section in sections[1:]:
+            outBuffer += section.save(offset)
+            if section.type != 8:
+                offset += len(section.data)
+
+        for section in sections:
+            if section.type != 8:
+                outBuffer += section.data
+
+        return outBuffer
+
+    def saveRpx(self, level=ZLIB_LEVEL_DEFAULT, workers=None, processes=False, passthrough=None):
+        return saveRpx(self.header, self.materialize(), self.secHeadEnts.index(self.shStrTable), level, workers, processes, passthrough)
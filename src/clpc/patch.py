@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Patches.hax formats
+#
+# Version 1 (default):
+#   u16 record count, followed by (u16 size, u32 address, data) per record, in no particular order.
+#
+# Version 2 (indexed):
+#   Header (0x20 bytes):
+#     char[4] magic ("PHAX"), u16 version (2), u16 header size,
+#     u32 record count, u32 index offset, u32 payload offset, u32 payload size, 8 reserved bytes
+#   Index (0x10 bytes per record, sorted by address):
+#     u32 address, u32 size, u32 payload offset (relative to the payload), u8 kind, 1 reserved byte, u16 pattern size
+#   Payload:
+#     Record data, each aligned to PATCHES_V2_RECORD_ALIGN, starting at a PATCHES_V2_PAYLOAD_ALIGN boundary.
+#
+#   Record kinds:
+#     0 (copy):    'size' bytes of data are copied to 'address'. Pattern size is 0.
+#     1 (fill):    A 'pattern size' bytes pattern is repeated to fill 'size' bytes at 'address'.
+#
+#   Every patched address is covered by an index entry, so the loader can binary-search the index and
+#   apply the records of a memory region in one pass.
+#   Records with identical data (or fill pattern) share a single copy of it in the payload,
+#   i.e., several index entries may have the same payload offset (e.g., a hook applied at several addresses).
+
+
+# Built-in
+from bisect import bisect_right
+from operator import itemgetter
+import struct
+
+
+# Local
+from .common import align
+from .common import PACK_U16
+from .common import PACK_U32
+
+
+# Patches.hax record data size is a u16; records are split at the largest word-aligned size below the limit
+PATCHES_RECORD_MAX_SIZE = 0xFFFC
+
+PATCHES_V2_MAGIC = b"PHAX"
+PATCHES_V2_VERSION = 2
+
+PATCHES_V2_HEADER_STRUCT = struct.Struct(">4sHHIIII8x")
+PATCHES_V2_INDEX_STRUCT = struct.Struct(">IIIBxH")
+
+PATCHES_V2_PAYLOAD_ALIGN = 0x20
+PATCHES_V2_RECORD_ALIGN = 4
+
+PATCHES_V2_KIND_COPY = 0
+PATCHES_V2_KIND_FILL = 1
+
+
+class FillData:
+    """
+    Patch data made of 'pattern' repeated 'count' times, which is only expanded by consumers that need the bytes.
+    """
+
+    __slots__ = ("pattern", "count")
+
+    def __init__(self, pattern, count):
+        self.pattern = pattern
+        self.count = count
+
+    def __len__(self):
+        return len(self.pattern) * self.count
+
+    def __bytes__(self):
+        return self.pattern * self.count
+
+
+def findOverlaps(patches):
+    """
+    Finds overlapping patches with a single sweep over the patches sorted by address, in O(n log n).
+
+    'patches' is an iterable of (address, size, owner) tuples.
+    Returns a list of ((address, size, owner), (address, size, owner)) pairs, where the second patch
+    overlaps the first (i.e., the furthest-reaching patch that starts before it).
+    """
+
+    overlaps = []
+
+    reach = None  # Patch with the highest end address so far
+    reach_end = 0
+
+    for patch in sorted(patches, key=lambda patch: patch[0]):
+        address, size, _ = patch
+
+        if reach is not None and address < reach_end:
+            overlaps.append((reach, patch))
+
+        if reach is None or address + size > reach_end:
+            reach = patch
+            reach_end = address + size
+
+    return overlaps
+
+
+def coalescePatches(patches, max_size=PATCHES_RECORD_MAX_SIZE):
+    """
+    Sorts (address, data) patches by address and merges contiguous or touching ones into a single record.
+    Records are only split where they exceed 'max_size' (None -> never split).
+    Returns a list of (address, data) records.
+    """
+
+    merged = []
+
+    for address, data in sorted(patches, key=itemgetter(0)):
+        if merged:
+            last_address, last_data = merged[-1]
+            if address <= last_address + len(last_data):
+                offset = address - last_address
+                last_data[offset:offset + len(data)] = data
+                continue
+
+        merged.append((address, bytearray(data)))
+
+    if max_size is None:
+        return merged
+
+    records = []
+
+    for address, data in merged:
+        if len(data) <= max_size:
+            records.append((address, data))
+            continue
+
+        for offset in range(0, len(data), max_size):
+            records.append((address + offset, data[offset:offset + max_size]))
+
+    return records
+
+
+def savePatches(records):
+    """
+    Serializes (address, data) records to the Patches.hax format:
+    u16 record count, followed by (u16 size, u32 address, data) per record.
+    """
+
+    if len(records) > 0xFFFF:
+        raise ValueError("Too many patch records for Patches.hax: %d" % len(records))
+
+    pack_u16 = PACK_U16
+    pack_u32 = PACK_U32
+
+    patch_buf = bytearray(pack_u16(len(records)))
+
+    for address, data in records:
+        patch_buf += pack_u16(len(data))
+        patch_buf += pack_u32(address)
+        patch_buf += data
+
+    return patch_buf
+
+
+def savePatchesV2(records, fills=(), shared=()):
+    """
+    Serializes (address, data) records, (address, pattern, count) fills and
+    (address list, data) shared records to the indexed Patches.hax (version 2) format.
+    Identical copy and fill payloads are only stored once, and each address of a shared record
+    gets its own index entry, pointing to the same payload.
+    """
+
+    entries = [(address, data, None) for address, data in records]
+    entries.extend((address, pattern, count) for address, pattern, count in fills)
+
+    for addresses, data in shared:
+        data = bytes(data)
+        entries.extend((address, data, None) for address in addresses)
+
+    entries.sort(key=itemgetter(0))
+
+    count = len(entries)
+
+    header_size = PATCHES_V2_HEADER_STRUCT.size
+    index_offset = header_size
+    payload_offset = align(index_offset + count * PATCHES_V2_INDEX_STRUCT.size, PATCHES_V2_PAYLOAD_ALIGN)
+
+    index_pack = PATCHES_V2_INDEX_STRUCT.pack
+
+    index_buf = bytearray()
+    payload_buf = bytearray()
+
+    data_offsets = {}
+
+    for address, data, fill_count in entries:
+        data = bytes(data)
+
+        data_offset = data_offsets.get(data)
+        if data_offset is None:
+            data_offset = align(len(payload_buf), PATCHES_V2_RECORD_ALIGN)
+            payload_buf += b'\0' * (data_offset - len(payload_buf))
+            payload_buf += data
+            data_offsets[data] = data_offset
+
+        if fill_count is None:
+            index_buf += index_pack(address, len(data), data_offset, PATCHES_V2_KIND_COPY, 0)
+        else:
+            index_buf += index_pack(address, len(data) * fill_count, data_offset, PATCHES_V2_KIND_FILL, len(data))
+
+    patch_buf = bytearray(PATCHES_V2_HEADER_STRUCT.pack(
+        PATCHES_V2_MAGIC,
+        PATCHES_V2_VERSION,
+        header_size,
+        count,
+        index_offset,
+        payload_offset,
+        len(payload_buf)
+    ))
+
+    patch_buf += index_buf
+    patch_buf += b'\0' * (payload_offset - len(patch_buf))
+    patch_buf += payload_buf
+
+    return patch_buf
+
+
+def loadPatches(data):
+    """
+    Reads a Patches.hax file of any version.
+    Returns a list of (address, data) records, in file order, with fills expanded.
+    """
+
+    if data[:4] == PATCHES_V2_MAGIC:
+        return loadPatchesV2(data)
+
+    (count,) = struct.unpack_from(">H", data, 0)
+    pos = 2
+
+    records = []
+    for _ in range(count):
+        size, address = struct.unpack_from(">HI", data, pos)
+        pos += 6
+
+        records.append((address, bytes(data[pos:pos + size])))
+        pos += size
+
+    if pos != len(data):
+        raise ValueError("Unexpected trailing data in Patches.hax")
+
+    return records
+
+
+def loadPatchesV2(data):
+    magic, version, header_size, count, index_offset, payload_offset, payload_size = PATCHES_V2_HEADER_STRUCT.unpack_from(data, 0)
+    if magic != PATCHES_V2_MAGIC or version != PATCHES_V2_VERSION:
+        raise ValueError("Unsupported Patches.hax version")
+
+    index_unpack_from = PATCHES_V2_INDEX_STRUCT.unpack_from
+    index_size = PATCHES_V2_INDEX_STRUCT.size
+
+    records = []
+    for i in range(count):
+        address, size, data_offset, kind, pattern_size = index_unpack_from(data, index_offset + i * index_size)
+
+        if kind == PATCHES_V2_KIND_COPY:
+            stored_size = size
+
+        elif kind == PATCHES_V2_KIND_FILL:
+            if not pattern_size or size % pattern_size:
+                raise ValueError("Invalid Patches.hax fill record: 0x%08X" % address)
+
+            stored_size = pattern_size
+
+        else:
+            raise ValueError("Unknown Patches.hax record kind: %d" % kind)
+
+        if data_offset + stored_size > payload_size:
+            raise ValueError("Patches.hax record exceeds payload: 0x%08X" % address)
+
+        start = payload_offset + data_offset
+        record_data = bytes(data[start:start + stored_size])
+        if kind == PATCHES_V2_KIND_FILL:
+            record_data *= size // pattern_size
+
+        records.append((address, record_data))
+
+    return records
+
+
+def loadPatchesV2Index(data):
+    """
+    Returns the (address, size) of every index entry of a Patches.hax (version 2) file, in index order.
+    """
+
+    magic, version, _, count, index_offset, _, _ = PATCHES_V2_HEADER_STRUCT.unpack_from(data, 0)
+    if magic != PATCHES_V2_MAGIC or version != PATCHES_V2_VERSION:
+        raise ValueError("Unsupported Patches.hax version")
+
+    index_size = PATCHES_V2_INDEX_STRUCT.size
+    return [(address, size) for address, size, _, _, _ in PATCHES_V2_INDEX_STRUCT.iter_unpack(data[index_offset:index_offset + count * index_size])]
+
+
+def findUnindexedPatches(data, patches):
+    """
+    Binary-searches the index of a Patches.hax (version 2) file for every (address, size) of 'patches',
+    the same way a loader looks up a memory region.
+    Returns the patches that are not covered by an index entry (empty if the index is sorted and complete).
+    """
+
+    index = loadPatchesV2Index(data)
+    index_addresses = [address for address, _ in index]
+
+    # The index must be sorted for the search to be meaningful at all
+    if index_addresses != sorted(index_addresses):
+        return list(patches)
+
+    unindexed = []
+
+    for address, size in patches:
+        i = bisect_right(index_addresses, address) - 1
+        if i < 0:
+            unindexed.append((address, size))
+            continue
+
+        entry_address, entry_size = index[i]
+        if address + size > entry_address + entry_size:
+            unindexed.append((address, size))
+
+    return unindexed
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Patch generation - Streams the resolved patches of all hooks (see clpc.hookColumns) to one or more sinks
+#
+# A sink is any object with:
+#   add(address, data, hook): Consumes one resolved patch ('hook' is the hook it comes from)
+#                             'data' is a bytes-like object, or a clpc.patch.FillData to expand with bytes() if needed
+#   finish():                 Called once the stream is exhausted; its return value is passed back to the caller
+#
+# The stream itself holds one patch at a time. OverlayPatchSink and SimulatorSink apply each patch as it arrives,
+# while PatchesHaxSink has to buffer the whole patch set (see its notes).
+
+
+# Built-in
+import itertools
+
+
+# Local
+from .patch import coalescePatches
+from .patch import FillData
+from .patch import findUnindexedPatches
+from .patch import savePatches
+from .patch import savePatchesV2
+
+
+# Base sections patches can be applied to
+PATCHABLE_SECTION_NAMES = (".text", ".rodata", ".data", ".bss")
+
+
+def checkPatchRange(section_index, address, size):
+    """
+    Checks that the patch [address, address + size) can be applied to the base sections of 'section_index'.
+    Returns (section, None), where 'section' is the result of section_index.find(address), or (None, reason).
+    """
+
+    section = section_index.find(address)
+    if section is None or section[0].name not in PATCHABLE_SECTION_NAMES:
+        nearest = section_index.findNearest(address)
+        if nearest is None:
+            return None, "Patch at unknown region (before the first section)."
+
+        entry, _, entry_start, entry_end = nearest
+        if address < entry_end:
+            return None, "Patch at unknown region (inside %s: 0x%08X - 0x%08X)." % (entry.name, entry_start, entry_end)
+
+        return None, "Patch at unknown region (0x%X byte(s) past the end of %s: 0x%08X - 0x%08X)." % (address - entry_end, entry.name, entry_start, entry_end)
+
+    entry, _, entry_start, entry_end = section
+
+    if entry.type == 8:
+        return None, "Patching .bss is not possible."
+
+    if address + size > entry_end:
+        return None, "Patch exceeds section range (%s: 0x%08X - 0x%08X)." % (entry.name, entry_start, entry_end)
+
+    return section, None
+
+
+def consumePatches(patches, sinks):
+    """
+    Feeds every patch of 'patches' to all of 'sinks' in a single pass.
+    Returns the list of the values returned by each sink's finish().
+    """
+
+    sinks_add = [sink.add for sink in sinks]
+
+    for address, data, hook in patches:
+        for add in sinks_add:
+            add(address, data, hook)
+
+    return [sink.finish() for sink in sinks]
+
+
+class OverlayPatchSink:
+    """
+    Applies patches to an ELFOverlay of a BaseImage, removing the relocations they overwrite.
+    Patches that fail checkPatchRange are skipped, and listed in 'skipped' as (address, reason).
+    """
+
+    def __init__(self, overlay, image, verbose=True):
+        self.overlay = overlay
+        self.image = image
+        self.verbose = verbose  # Whether to print skipped patches (e.g., not already reported by a preflight check)
+
+        self.sectionIndex = image.getSectionIndex()
+
+        self.count = 0
+        self.skipped = []
+
+    def skip(self, address, reason):
+        if self.verbose:
+            print(reason)
+            print("Skipping patch at address: 0x%08X" % address)
+
+        self.skipped.append((address, reason))
+
+    def add(self, address, data, _):
+        end_address = address + len(data)
+
+        section, reason = checkPatchRange(self.sectionIndex, address, len(data))
+        if section is None:
+            self.skip(address, reason)
+            return
+
+        entry, entry_rela, entry_start, _ = section
+
+        if entry_rela is not None:
+            self.overlay.removeRelocations(entry_rela, self.image.getRelocationIndex(entry_rela).find(address, end_address))
+
+        if isinstance(data, FillData):
+            data = bytes(data)
+
+        self.overlay.patch(entry, address - entry_start, data)
+        self.count += 1
+
+    def finish(self):
+        return self.overlay
+
+
+class PatchesHaxSink:
+    """
+    Collects patches for Patches.hax of the given version.
+    finish() returns the serialized file (and may raise ValueError for version 1).
+
+    Notes:
+    * Version 2 output uses fill records for repeated patterns, and stores the data of address-independent
+      hooks applied at several addresses once, with an index entry per address.
+    * Version 2 output is checked to have every patch reachable through the sorted index.
+    * Buffering trade-off: records are sorted, coalesced and (for version 2) indexed, which needs the whole
+      patch set, so every record is kept until finish() and memory grows with the size of the output.
+      Only the data that ends up in the file is kept, i.e., fill data and shared data are not duplicated.
+    """
+
+    def __init__(self, version=1):
+        assert version in (1, 2)
+
+        self.version = version
+
+        self.patches = []
+        self.fills = []
+        self.shared = {}  # hook -> (address list, data)
+
+        self.patchCount = 0
+        self.recordCount = 0
+
+    def add(self, address, data, hook):
+        self.patchCount += 1
+
+        if isinstance(data, FillData):
+            if self.version == 2:
+                self.fills.append((address, data.pattern, data.count))
+                return
+
+            data = bytes(data)
+
+        if self.version == 2:
+            if len(hook.address) > 1 and hook.isAddressIndependent():
+                shared = self.shared.get(hook)
+                if shared is None:
+                    self.shared[hook] = ([address], data)
+                else:
+                    shared[0].append(address)
+
+                return
+
+        self.patches.append((address, data))
+
+    def finish(self):
+        if self.version == 2:
+            records = coalescePatches(self.patches, None)
+            shared = list(self.shared.values())
+
+            patch_buf = savePatchesV2(records, self.fills, shared)
+
+            unindexed = findUnindexedPatches(patch_buf, itertools.chain(
+                ((address, len(data)) for address, data in records),
+                ((address, len(pattern) * count) for address, pattern, count in self.fills),
+                ((address, len(data)) for addresses, data in shared for address in addresses)
+            ))
+            if unindexed:
+                raise ValueError("Patches.hax index does not cover %d patch(es), first at 0x%08X" % (len(unindexed), unindexed[0][0]))
+
+            self.recordCount = len(records) + len(self.fills) + sum(len(addresses) for addresses, _ in shared)
+            return patch_buf
+
+        # Version 1 has neither fill nor shared records, so every patch was kept as-is by add()
+        records = coalescePatches(self.patches)
+
+        self.recordCount = len(records)
+        return savePatches(records)
+
+
+class SimulatorSink:
+    """
+    Writes patches straight into a clpc.simulator.SparseMemory as they arrive, without keeping them.
+    finish() returns the memory.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+
+        self.count = 0
+        self.byteCount = 0
+
+    def add(self, address, data, _):
+        if isinstance(data, FillData):
+            data = bytes(data)
+
+        self.memory.write(address, data)
+        self.count += 1
+        self.byteCount += len(data)
+
+    def finish(self):
+        return self.memory
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# CafeLoader payload formats (Code.bin, Data.bin)
+#
+# Raw (default):
+#   The bytes to copy to the text/data address, as is.
+#
+# Compact:
+#   Header (0x20 bytes):
+#     char[4] magic ("CPAY"), u16 version (1), u16 header size, u32 flags,
+#     u32 decoded size, u32 run count, u32 body size, u32 CRC-32 of the decoded bytes, 4 reserved bytes
+#   Body (zlib stream if flags & PAYLOAD_FLAG_DEFLATE, stored otherwise):
+#     Run table (8 bytes per run, sorted by offset): u32 offset, u32 size
+#     Run data, concatenated in run table order
+#
+#   The loader zeroes 'decoded size' bytes at the destination and copies every run to its offset,
+#   so zero runs (alignment gaps, zero-initialized data) are neither stored nor read from storage.
+#
+# The format is not detected from the content (a raw payload may start with the magic), so the loader
+# must be told the format of the target ("PayloadFormat" target option).
+
+
+# Built-in
+import re
+import struct
+import zlib
+
+
+PAYLOAD_FORMAT_RAW = "raw"
+PAYLOAD_FORMAT_COMPACT = "compact"
+PAYLOAD_FORMAT_COMPACT_DEFLATE = "compact-deflate"
+
+PAYLOAD_FORMATS = (PAYLOAD_FORMAT_RAW, PAYLOAD_FORMAT_COMPACT, PAYLOAD_FORMAT_COMPACT_DEFLATE)
+
+PAYLOAD_MAGIC = b"CPAY"
+PAYLOAD_VERSION = 1
+
+PAYLOAD_HEADER_STRUCT = struct.Struct(">4sHHIIIII4x")
+PAYLOAD_RUN_STRUCT = struct.Struct(">II")
+
+PAYLOAD_FLAG_DEFLATE = 1
+
+# Zero runs shorter than this are kept inside the surrounding run, as splitting costs a run table entry
+PAYLOAD_MIN_ZERO_RUN = 0x20
+
+PAYLOAD_ZLIB_LEVEL = 9
+
+PAYLOAD_ZERO_RUN_RE_OBJ = re.compile(b"\\x00{%d,}" % PAYLOAD_MIN_ZERO_RUN)
+
+
+def findRuns(data):
+    """
+    Returns the (offset, size) of every non-zero run of 'data', split at zero runs of at least PAYLOAD_MIN_ZERO_RUN bytes.
+    """
+
+    runs = []
+    pos = 0
+
+    for match in PAYLOAD_ZERO_RUN_RE_OBJ.finditer(data):
+        start = match.start()
+        if start > pos:
+            runs.append((pos, start - pos))
+
+        pos = match.end()
+
+    if pos < len(data):
+        runs.append((pos, len(data) - pos))
+
+    return runs
+
+
+def savePayload(data, payload_format=PAYLOAD_FORMAT_RAW):
+    assert payload_format in PAYLOAD_FORMATS
+
+    data = bytes(data)
+
+    if payload_format == PAYLOAD_FORMAT_RAW:
+        return data
+
+    runs = findRuns(data)
+
+    body = bytearray(len(runs) * PAYLOAD_RUN_STRUCT.size)
+    for i, (offset, size) in enumerate(runs):
+        PAYLOAD_RUN_STRUCT.pack_into(body, i * PAYLOAD_RUN_STRUCT.size, offset, size)
+
+    body += b''.join(data[offset:offset + size] for offset, size in runs)
+
+    flags = 0
+    if payload_format == PAYLOAD_FORMAT_COMPACT_DEFLATE:
+        body = zlib.compress(body, PAYLOAD_ZLIB_LEVEL)
+        flags |= PAYLOAD_FLAG_DEFLATE
+
+    header = PAYLOAD_HEADER_STRUCT.pack(
+        PAYLOAD_MAGIC,
+        PAYLOAD_VERSION,
+        PAYLOAD_HEADER_STRUCT.size,
+        flags,
+        len(data),
+        len(runs),
+        len(body),
+        zlib.crc32(data) & 0xFFFFFFFF
+    )
+
+    return header + body
+
+
+def loadPayload(data, payload_format=PAYLOAD_FORMAT_RAW):
+    """
+    Returns the decoded bytes of a payload saved in 'payload_format'.
+    Raises ValueError if a compact payload is malformed or does not match 'payload_format'.
+    """
+
+    assert payload_format in PAYLOAD_FORMATS
+
+    if payload_format == PAYLOAD_FORMAT_RAW:
+        return bytes(data)
+
+    if data[:4] != PAYLOAD_MAGIC:
+        raise ValueError("Expected a %s payload" % payload_format)
+
+    if len(data) < PAYLOAD_HEADER_STRUCT.size:
+        raise ValueError("Truncated payload header")
+
+    (
+        _,
+        version,
+        header_size,
+        flags,
+        decoded_size,
+        run_count,
+        body_size,
+        crc
+    ) = PAYLOAD_HEADER_STRUCT.unpack_from(data)
+
+    if version != PAYLOAD_VERSION:
+        raise ValueError("Unsupported payload version: %d" % version)
+
+    if bool(flags & PAYLOAD_FLAG_DEFLATE) != (payload_format == PAYLOAD_FORMAT_COMPACT_DEFLATE):
+        raise ValueError("Expected a %s payload" % payload_format)
+
+    body = data[header_size:header_size + body_size]
+    if len(body) != body_size:
+        raise ValueError("Truncated payload body")
+
+    if flags & PAYLOAD_FLAG_DEFLATE:
+        body = zlib.decompress(body)
+
+    run_data_offset = run_count * PAYLOAD_RUN_STRUCT.size
+    if len(body) < run_data_offset:
+        raise ValueError("Truncated payload run table")
+
+    decoded = bytearray(decoded_size)
+    pos = run_data_offset
+
+    for offset, size in PAYLOAD_RUN_STRUCT.iter_unpack(body[:run_data_offset]):
+        if offset + size > decoded_size or pos + size > len(body):
+            raise ValueError("Payload run out of range: 0x%X (0x%X bytes)" % (offset, size))
+
+        decoded[offset:offset + size] = body[pos:pos + size]
+        pos += size
+
+    if zlib.crc32(decoded) & 0xFFFFFFFF != crc:
+        raise ValueError("Payload checksum mismatch")
+
+    return bytes(decoded)
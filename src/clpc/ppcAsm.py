@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# In-process assembler for a subset of Espresso (PowerPC 750) instructions, used by asm hooks
+#
+# Syntax:
+#   One instruction per line (or separated by ';'). Comments start with '#' or '//'.
+#   Labels are declared as "name:" and can be used as branch targets.
+#   Registers: r0-r31 (or sp, rtoc), f0-f31, cr0-cr7.
+#   Expressions: a number, a label or a symbol, optionally followed by +/- a number,
+#                and optionally suffixed with @ha, @h or @l (16-bit halves of the value).
+#   Branch targets are absolute addresses (typically a label or a symbol), encoded relative to the instruction.
+#   The ".int" directive emits a raw 32-bit value.
+
+
+# Built-in
+import re
+import struct
+
+
+class AsmError(ValueError):
+    pass
+
+
+REGISTER_ALIASES = {
+    "sp":   1,
+    "rtoc": 2
+}
+
+EXPRESSION_RE_OBJ = re.compile(r'^(?P<base>[^\s+\-@][^\s+@]*?|)\s*(?P<offset>[+\-]\s*(?:0[xX][0-9A-Fa-f]+|\d+))?(?:@(?P<suffix>ha|h|l))?$')
+NUMBER_RE_OBJ = re.compile(r'^[+\-]?(?:0[xX][0-9A-Fa-f]+|0[bB][01]+|\d+)$')
+MEMORY_OPERAND_RE_OBJ = re.compile(r'^(?P<disp>.*)\((?P<reg>[^()]+)\)$')
+LABEL_RE_OBJ = re.compile(r'^([A-Za-z_.$][\w.$]*)\s*:')
+
+# D-form, rD, rA, SIMM
+D_ARITH_OPS = {
+    "mulli":    7,
+    "subfic":   8,
+    "addic":    12,
+    "addic.":   13,
+    "addi":     14,
+    "addis":    15
+}
+
+# D-form, rA, rS, UIMM
+D_LOGICAL_OPS = {
+    "ori":      24,
+    "oris":     25,
+    "xori":     26,
+    "xoris":    27,
+    "andi.":    28,
+    "andis.":   29
+}
+
+# D-form, rD/frD, d(rA)
+D_MEMORY_OPS = {
+    "lwz":      (32, 'r'),
+    "lwzu":     (33, 'r'),
+    "lbz":      (34, 'r'),
+    "lbzu":     (35, 'r'),
+    "stw":      (36, 'r'),
+    "stwu":     (37, 'r'),
+    "stb":      (38, 'r'),
+    "stbu":     (39, 'r'),
+    "lhz":      (40, 'r'),
+    "lhzu":     (41, 'r'),
+    "lha":      (42, 'r'),
+    "lhau":     (43, 'r'),
+    "sth":      (44, 'r'),
+    "sthu":     (45, 'r'),
+    "lmw":      (46, 'r'),
+    "stmw":     (47, 'r'),
+    "lfs":      (48, 'f'),
+    "lfsu":     (49, 'f'),
+    "lfd":      (50, 'f'),
+    "lfdu":     (51, 'f'),
+    "stfs":     (52, 'f'),
+    "stfsu":    (53, 'f'),
+    "stfd":     (54, 'f'),
+    "stfdu":    (55, 'f')
+}
+
+# XO-form (opcode 31), rD, rA, rB
+XO_OPS = {
+    "subfc":    8,
+    "addc":     10,
+    "mulhwu":   11,
+    "subf":     40,
+    "mulhw":    75,
+    "subfe":    136,
+    "adde":     138,
+    "mullw":    235,
+    "add":      266,
+    "divwu":    459,
+    "divw":     491
+}
+
+# X-form (opcode 31), rA, rS, rB
+X_LOGICAL_OPS = {
+    "slw":      24,
+    "and":      28,
+    "andc":     60,
+    "nor":      124,
+    "xor":      316,
+    "orc":      412,
+    "or":       444,
+    "nand":     476,
+    "srw":      536,
+    "sraw":     792
+}
+
+# X-form (opcode 31), rA, rS
+X_UNARY_OPS = {
+    "cntlzw":   26,
+    "extsh":    922,
+    "extsb":    954
+}
+
+# A-form floating-point, frD, frA, frB
+FP_AB_OPS = {
+    "fdivs":    (59, 18),
+    "fsubs":    (59, 20),
+    "fadds":    (59, 21),
+    "fdiv":     (63, 18),
+    "fsub":     (63, 20),
+    "fadd":     (63, 21)
+}
+
+# A-form floating-point, frD, frA, frC
+FP_AC_OPS = {
+    "fmuls":    (59, 25),
+    "fmul":     (63, 25)
+}
+
+# X-form floating-point (opcode 63), frD, frB
+FP_UNARY_OPS = {
+    "frsp":     12,
+    "fctiwz":   15,
+    "fneg":     40,
+    "fmr":      72,
+    "fabs":     264
+}
+
+# Conditional branches: (BO, CR bit)
+BRANCH_CONDITIONS = {
+    "blt":  (12, 0),
+    "bgt":  (12, 1),
+    "beq":  (12, 2),
+    "bge":  (4,  0),
+    "ble":  (4,  1),
+    "bne":  (4,  2)
+}
+
+# Special-purpose register moves: mnemonic -> (SPR, is mt)
+SPR_OPS = {
+    "mflr":     (8, False),
+    "mtlr":     (8, True),
+    "mfctr":    (9, False),
+    "mtctr":    (9, True)
+}
+
+FIXED_OPS = {
+    "nop":      0x60000000,
+    "blr":      0x4E800020,
+    "blrl":     0x4E800021,
+    "bctr":     0x4E800420,
+    "bctrl":    0x4E800421,
+    "sc":       0x44000002,
+    "trap":     0x7FE00008
+}
+
+
+def parseNumber(s):
+    return int(s, 0)
+
+
+def parseRegister(s, kind='r'):
+    s = s.strip().lower()
+    if kind == 'r' and s in REGISTER_ALIASES:
+        return REGISTER_ALIASES[s]
+
+    if s.startswith(kind):
+        s = s[len(kind):]
+
+    if not s.isdigit():
+        raise AsmError("Invalid register: %r" % s)
+
+    value = int(s)
+    if not 0 <= value < (8 if kind == "cr" else 32):
+        raise AsmError("Register out of range: %r" % s)
+
+    return value
+
+
+class Instruction:
+    def __init__(self, mnemonic, operands, line):
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.line = line
+
+
+class Program:
+    """
+    Parsed asm source. Each instruction is 4 bytes, so the size and label offsets are known before assembling.
+    """
+
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}  # name -> offset
+
+    @property
+    def size(self):
+        return 4 * len(self.instructions)
+
+    @staticmethod
+    def parse(source):
+        program = Program()
+        instructions = program.instructions
+        labels = program.labels
+
+        for physical_line in source.splitlines():
+            # Comments run to the end of the physical line, so they are removed before splitting statements
+            for comment in ('#', "//"):
+                pos = physical_line.find(comment)
+                if pos != -1:
+                    physical_line = physical_line[:pos]
+
+            for line in physical_line.split(';'):
+                line = line.strip()
+
+                while True:
+                    match = LABEL_RE_OBJ.match(line)
+                    if match is None:
+                        break
+
+                    label = match.group(1)
+                    if label in labels:
+                        raise AsmError("Duplicate label: %r" % label)
+
+                    labels[label] = 4 * len(instructions)
+                    line = line[match.end():].strip()
+
+                if not line:
+                    continue
+
+                parts = line.split(None, 1)
+                mnemonic = parts[0].lower()
+                operands = [operand.strip() for operand in parts[1].split(',')] if len(parts) > 1 else []
+
+                instructions.append(Instruction(mnemonic, operands, line))
+
+        if not instructions:
+            raise AsmError("No instructions")
+
+        return program
+
+    def getSymbols(self):
+        """
+        Returns the (non-label) symbols referenced by the expressions of this program.
+        """
+
+        symbols = []
+        labels = self.labels
+
+        for instruction in self.instructions:
+            for operand in instruction.operands:
+                match = MEMORY_OPERAND_RE_OBJ.match(operand)
+                if match is not None:
+                    operand = match.group("disp").strip()
+
+                match = EXPRESSION_RE_OBJ.match(operand)
+                if match is None:
+                    continue
+
+                base = match.group("base")
+                if not base or NUMBER_RE_OBJ.match(base) or base in labels or base in symbols:
+                    continue
+
+                if self.isRegisterOperand(instruction.mnemonic, base):
+                    continue
+
+                symbols.append(base)
+
+        return symbols
+
+    @staticmethod
+    def isRegisterOperand(mnemonic, s):
+        s = s.lower()
+        if s in REGISTER_ALIASES:
+            return True
+
+        for prefix in ("cr", 'r', 'f'):
+            if s.startswith(prefix) and s[len(prefix):].isdigit():
+                return True
+
+        return False
+
+    def assemble(self, address, symbols):
+        """
+        Returns the big-endian machine code of this program placed at 'address'.
+        'symbols' must map every symbol returned by getSymbols() to its address.
+        """
+
+        return self.encodeAll(address, symbols)
+
+    def check(self, address):
+        """
+        Checks the syntax of this program placed at 'address' before the symbol values are known.
+        Operands which depend on symbols are range-checked by assemble().
+        """
+
+        self.encodeAll(address, None)
+
+    def encodeAll(self, address, symbols):
+        words = []
+
+        for i, instruction in enumerate(self.instructions):
+            try:
+                words.append(self.encode(instruction, address + 4 * i, address, symbols) & 0xFFFFFFFF)
+            except AsmError as e:
+                raise AsmError("%s (in %r)" % (e, instruction.line)) from None
+
+        return struct.pack(">%dI" % len(words), *words)
+
+    def evaluate(self, s, base_address, symbols):
+        """
+        Returns (value, has 16-bit suffix).
+        If 'symbols' is None, the value of an expression based on a symbol is None.
+        """
+
+        s = s.strip()
+        if NUMBER_RE_OBJ.match(s):
+            return parseNumber(s), False
+
+        match = EXPRESSION_RE_OBJ.match(s)
+        if match is None:
+            raise AsmError("Invalid expression: %r" % s)
+
+        base = match.group("base")
+        if not base:
+            raise AsmError("Invalid expression: %r" % s)
+
+        if NUMBER_RE_OBJ.match(base):
+            value = parseNumber(base)
+        elif base in self.labels:
+            value = base_address + self.labels[base]
+        elif symbols is None:
+            return None, match.group("suffix") is not None
+        elif base in symbols:
+            value = symbols[base]
+        else:
+            raise AsmError("Unknown symbol: %r" % base)
+
+        offset = match.group("offset")
+        if offset is not None:
+            value += parseNumber(offset.replace(' ', ''))
+
+        suffix = match.group("suffix")
+        if suffix == "ha":
+            return ((value + 0x8000) >> 16) & 0xFFFF, True
+        if suffix == 'h':
+            return (value >> 16) & 0xFFFF, True
+        if suffix == 'l':
+            return value & 0xFFFF, True
+
+        return value, False
+
+    def evaluateSigned16(self, s, base_address, symbols, hi=0x7FFF):
+        value, is_half = self.evaluate(s, base_address, symbols)
+        if value is None:
+            return 0
+
+        if not is_half and not -0x8000 <= value <= hi:
+            raise AsmError("Signed 16-bit immediate out of range: %r" % s)
+
+        return value & 0xFFFF
+
+    def evaluateUnsigned16(self, s, base_address, symbols):
+        value, is_half = self.evaluate(s, base_address, symbols)
+        if value is None:
+            return 0
+
+        if not is_half and not 0 <= value <= 0xFFFF:
+            raise AsmError("Unsigned 16-bit immediate out of range: %r" % s)
+
+        return value & 0xFFFF
+
+    def evaluateRange(self, s, lo, hi, base_address, symbols):
+        value, _ = self.evaluate(s, base_address, symbols)
+        if value is None:
+            return max(lo, 0)
+
+        if not lo <= value <= hi:
+            raise AsmError("Immediate out of range [%d, %d]: %r" % (lo, hi, s))
+
+        return value
+
+    def encode(self, instruction, address, base_address, symbols):
+        mnemonic = instruction.mnemonic
+        operands = instruction.operands
+
+        def expect(count):
+            if len(operands) != count:
+                raise AsmError("Expected %d operand(s) for %r" % (count, mnemonic))
+
+        reg = parseRegister
+        simm = lambda s: self.evaluateSigned16(s, base_address, symbols)
+        simm_hi = lambda s: self.evaluateSigned16(s, base_address, symbols, 0xFFFF)  # Upper halves are commonly written unsigned
+        uimm = lambda s: self.evaluateUnsigned16(s, base_address, symbols)
+        imm = lambda s, lo, hi: self.evaluateRange(s, lo, hi, base_address, symbols)
+
+        def target(s, bits):
+            value, _ = self.evaluate(s, base_address, symbols)
+            if value is None:
+                return 0
+
+            displacement = value - address
+            limit = 1 << (bits - 1)
+            if displacement & 3 or not -limit <= displacement < limit:
+                raise AsmError("Branch target out of range or misaligned: %r" % s)
+
+            return displacement & ((1 << bits) - 1)
+
+        def crf_and_rest(count):
+            # Optional leading condition register field
+            if len(operands) == count + 1:
+                return reg(operands[0], "cr"), operands[1:]
+
+            expect(count)
+            return 0, operands
+
+        ### Fixed ###
+
+        if mnemonic in FIXED_OPS:
+            expect(0)
+            return FIXED_OPS[mnemonic]
+
+        if mnemonic in (".int", ".long", ".word"):
+            expect(1)
+            return imm(operands[0], -0x80000000, 0xFFFFFFFF)
+
+        ### Record forms ###
+
+        rc = 0
+        base_mnemonic = mnemonic
+        if mnemonic.endswith('.') and mnemonic not in D_ARITH_OPS and mnemonic not in D_LOGICAL_OPS:
+            base_mnemonic = mnemonic[:-1]
+            rc = 1
+
+        ### D-form ###
+
+        if mnemonic in D_ARITH_OPS:
+            expect(3)
+            value = simm_hi(operands[2]) if mnemonic == "addis" else simm(operands[2])
+            return (D_ARITH_OPS[mnemonic] << 26) | (reg(operands[0]) << 21) | (reg(operands[1]) << 16) | value
+
+        if mnemonic in ("li", "lis"):
+            expect(2)
+            if mnemonic == "li":
+                return (14 << 26) | (reg(operands[0]) << 21) | simm(operands[1])
+
+            return (15 << 26) | (reg(operands[0]) << 21) | simm_hi(operands[1])
+
+        if mnemonic == "subi":
+            expect(3)
+            value = imm(operands[2], -0x7FFF, 0x8000)
+            return (14 << 26) | (reg(operands[0]) << 21) | (reg(operands[1]) << 16) | (-value & 0xFFFF)
+
+        if mnemonic in D_LOGICAL_OPS:
+            expect(3)
+            return (D_LOGICAL_OPS[mnemonic] << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | uimm(operands[2])
+
+        if mnemonic in D_MEMORY_OPS:
+            expect(2)
+            opcode, kind = D_MEMORY_OPS[mnemonic]
+
+            match = MEMORY_OPERAND_RE_OBJ.match(operands[1])
+            if match is None:
+                raise AsmError("Expected a d(rA) operand: %r" % operands[1])
+
+            disp = match.group("disp").strip() or '0'
+            return (opcode << 26) | (reg(operands[0], kind) << 21) | (reg(match.group("reg")) << 16) | simm(disp)
+
+        if mnemonic in ("cmpwi", "cmplwi"):
+            crf, rest = crf_and_rest(2)
+            if mnemonic == "cmpwi":
+                return (11 << 26) | (crf << 23) | (reg(rest[0]) << 16) | simm(rest[1])
+
+            return (10 << 26) | (crf << 23) | (reg(rest[0]) << 16) | uimm(rest[1])
+
+        ### X/XO-form ###
+
+        if base_mnemonic in XO_OPS:
+            expect(3)
+            return (31 << 26) | (reg(operands[0]) << 21) | (reg(operands[1]) << 16) | (reg(operands[2]) << 11) | (XO_OPS[base_mnemonic] << 1) | rc
+
+        if base_mnemonic == "sub":
+            expect(3)
+            return (31 << 26) | (reg(operands[0]) << 21) | (reg(operands[2]) << 16) | (reg(operands[1]) << 11) | (40 << 1) | rc
+
+        if base_mnemonic == "neg":
+            expect(2)
+            return (31 << 26) | (reg(operands[0]) << 21) | (reg(operands[1]) << 16) | (104 << 1) | rc
+
+        if base_mnemonic in X_LOGICAL_OPS:
+            expect(3)
+            return (31 << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | (reg(operands[2]) << 11) | (X_LOGICAL_OPS[base_mnemonic] << 1) | rc
+
+        if base_mnemonic in ("mr", "not"):
+            expect(2)
+            rs = reg(operands[1])
+            return (31 << 26) | (rs << 21) | (reg(operands[0]) << 16) | (rs << 11) | ((444 if base_mnemonic == "mr" else 124) << 1) | rc
+
+        if base_mnemonic in X_UNARY_OPS:
+            expect(2)
+            return (31 << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | (X_UNARY_OPS[base_mnemonic] << 1) | rc
+
+        if base_mnemonic == "srawi":
+            expect(3)
+            return (31 << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | (imm(operands[2], 0, 31) << 11) | (824 << 1) | rc
+
+        if mnemonic in ("cmpw", "cmplw"):
+            crf, rest = crf_and_rest(2)
+            return (31 << 26) | (crf << 23) | (reg(rest[0]) << 16) | (reg(rest[1]) << 11) | ((0 if mnemonic == "cmpw" else 32) << 1)
+
+        if mnemonic in SPR_OPS:
+            expect(1)
+            spr, is_mt = SPR_OPS[mnemonic]
+            spr_field = ((spr & 0x1F) << 5) | (spr >> 5)
+            return (31 << 26) | (reg(operands[0]) << 21) | (spr_field << 11) | ((467 if is_mt else 339) << 1)
+
+        ### Rotate ###
+
+        if base_mnemonic in ("rlwinm", "rlwimi"):
+            expect(5)
+            sh, mb, me = (imm(operand, 0, 31) for operand in operands[2:])
+            opcode = 21 if base_mnemonic == "rlwinm" else 20
+            return (opcode << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | (sh << 11) | (mb << 6) | (me << 1) | rc
+
+        if base_mnemonic in ("slwi", "srwi", "clrlwi", "rotlwi"):
+            expect(3)
+            n = imm(operands[2], 0, 31)
+            sh, mb, me = {
+                "slwi":     (n, 0, 31 - n),
+                "srwi":     ((32 - n) & 31, n, 31),
+                "clrlwi":   (0, n, 31),
+                "rotlwi":   (n, 0, 31)
+            }[base_mnemonic]
+            return (21 << 26) | (reg(operands[1]) << 21) | (reg(operands[0]) << 16) | (sh << 11) | (mb << 6) | (me << 1) | rc
+
+        ### Floating-point ###
+
+        if base_mnemonic in FP_AB_OPS:
+            expect(3)
+            opcode, xo = FP_AB_OPS[base_mnemonic]
+            return (opcode << 26) | (reg(operands[0], 'f') << 21) | (reg(operands[1], 'f') << 16) | (reg(operands[2], 'f') << 11) | (xo << 1) | rc
+
+        if base_mnemonic in FP_AC_OPS:
+            expect(3)
+            opcode, xo = FP_AC_OPS[base_mnemonic]
+            return (opcode << 26) | (reg(operands[0], 'f') << 21) | (reg(operands[1], 'f') << 16) | (reg(operands[2], 'f') << 6) | (xo << 1) | rc
+
+        if base_mnemonic in FP_UNARY_OPS:
+            expect(2)
+            return (63 << 26) | (reg(operands[0], 'f') << 21) | (reg(operands[1], 'f') << 11) | (FP_UNARY_OPS[base_mnemonic] << 1) | rc
+
+        if mnemonic == "fcmpu":
+            crf, rest = crf_and_rest(2)
+            return (63 << 26) | (crf << 23) | (reg(rest[0], 'f') << 16) | (reg(rest[1], 'f') << 11)
+
+        ### Branches ###
+
+        if mnemonic in ("b", "bl"):
+            expect(1)
+            return (18 << 26) | target(operands[0], 26) | (mnemonic == "bl")
+
+        if mnemonic in ("ba", "bla"):
+            expect(1)
+            value = imm(operands[0], 0, 0x01FFFFFC)
+            if value & 3:
+                raise AsmError("Misaligned branch target: %r" % operands[0])
+
+            return (18 << 26) | value | 2 | (mnemonic == "bla")
+
+        link = 0
+        branch_mnemonic = mnemonic
+        if mnemonic[:-1] in BRANCH_CONDITIONS and mnemonic.endswith('l'):
+            branch_mnemonic = mnemonic[:-1]
+            link = 1
+
+        if branch_mnemonic in BRANCH_CONDITIONS:
+            crf, rest = crf_and_rest(1)
+            bo, bit = BRANCH_CONDITIONS[branch_mnemonic]
+            return (16 << 26) | (bo << 21) | ((4 * crf + bit) << 16) | target(rest[0], 16) | link
+
+        if mnemonic in ("bdnz", "bdz"):
+            expect(1)
+            return (16 << 26) | ((16 if mnemonic == "bdnz" else 18) << 21) | target(operands[0], 16)
+
+        raise AsmError("Unsupported instruction: %r" % mnemonic)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# RPX writer - Compresses RPL ELF sections in-process and emits the RPX directly
+# http://wiiubrew.org/wiki/RPL
+
+
+# Built-in
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import zlib
+
+
+# Local
+from .common import align
+from .common import PACK_U32
+
+
+SHT_NOBITS          = 8
+SHT_RPL_CRCS        = 0x80000003
+SHT_RPL_FILEINFO    = 0x80000004
+
+SHF_RPL_ZLIB        = 0x08000000
+
+ZLIB_LEVEL_DEFAULT  = 6
+
+# Sections smaller than this are not worth compressing
+COMPRESS_MIN_SIZE   = 0x18
+
+SECTION_DATA_ALIGN  = 0x40
+
+
+class RPX:
+    """
+    Read-only view over a compressed RPX file.
+    Section payloads are kept exactly as stored (i.e., still compressed).
+    """
+
+    class Section(struct.Struct):
+        def __init__(self, data, offset, endian):
+            super().__init__('%s10I' % endian)
+
+            (self.nameIdx,
+             self.type,
+             self.flags,
+             self.vAddr,
+             self.offset,
+             self.size_,
+             self.link,
+             self.info,
+             self.addrAlign,
+             self.entSize) = self.unpack_from(data, offset)
+
+            if self.type == SHT_NOBITS:
+                self.payload = b''
+            else:
+                self.payload = memoryview(data)[self.offset:self.offset + self.size_]
+
+        def getData(self):
+            payload = self.payload
+            if self.flags & SHF_RPL_ZLIB:
+                return zlib.decompress(payload[4:])
+
+            return bytes(payload)
+
+    def __init__(self, file):
+        with open(file, "rb") as inf:
+            self.data = inf.read()
+
+        data = self.data
+
+        assert data[:4] == b'\x7FELF'
+        if data[4] != 1:
+            raise NotImplementedError("Only 32-bit RPX files are supported.")
+
+        self.endian = endian = '<' if data[5] == 1 else '>'
+
+        (self.secHeadOff,) = struct.unpack_from('%sI' % endian, data, 0x20)
+        (self.secHeadEntSize,
+         self.secHeadNum,
+         self.namesSecHeadIdx) = struct.unpack_from('%s3H' % endian, data, 0x2E)
+
+        self.sections = []
+        pos = self.secHeadOff
+        for _ in range(self.secHeadNum):
+            self.sections.append(RPX.Section(data, pos, endian))
+            pos += self.secHeadEntSize
+
+        self.crcs = None
+        for section in self.sections:
+            if section.type == SHT_RPL_CRCS:
+                crcs_data = section.getData()
+                self.crcs = list(struct.unpack('%s%dI' % (endian, len(crcs_data) // 4), crcs_data))
+                break
+
+    def decompress(self):
+        """
+        Returns the uncompressed ELF image of this RPX.
+        """
+
+        assert self.secHeadEntSize == 0x28
+
+        data = self.data
+        endian = self.endian
+
+        sections = self.sections
+        sections_data = [b'' if section.type == SHT_NOBITS else section.getData() for section in sections]
+
+        outBuffer = bytearray(data[:self.secHeadOff])
+
+        offset = align(self.secHeadOff + len(sections) * self.secHeadEntSize, SECTION_DATA_ALIGN)
+
+        data_offsets = []
+        for i, (section, section_data) in enumerate(zip(sections, sections_data)):
+            if i == 0 or section.type == SHT_NOBITS:
+                section_offset = section.offset
+                section_size = section.size_
+
+            else:
+                section_offset = offset
+                section_size = len(section_data)
+                if section_size:
+                    offset = align(offset + section_size, SECTION_DATA_ALIGN)
+
+            outBuffer += struct.pack(
+                '%s10I' % endian,
+                section.nameIdx,
+                section.type,
+                section.flags & ~SHF_RPL_ZLIB,
+                section.vAddr,
+                section_offset,
+                section_size,
+                section.link,
+                section.info,
+                section.addrAlign,
+                section.entSize
+            )
+
+            data_offsets.append(section_offset)
+
+        for section, section_data, section_offset in zip(sections, sections_data, data_offsets):
+            if section.type == SHT_NOBITS or not section_data:
+                continue
+
+            outBuffer += b'\0' * (section_offset - len(outBuffer))
+            outBuffer += section_data
+
+        return outBuffer
+
+
+def compressData(data, level=ZLIB_LEVEL_DEFAULT):
+    # Compressed RPL section payload: u32 decompressed size followed by a zlib stream
+    return PACK_U32(len(data)) + zlib.compress(data, level)
+
+
+def isCompressible(section):
+    return section.type not in (SHT_NOBITS, SHT_RPL_CRCS, SHT_RPL_FILEINFO) and \
+           not section.flags & SHF_RPL_ZLIB and \
+           len(section.data) >= COMPRESS_MIN_SIZE
+
+
+def compressSections(sections, level=ZLIB_LEVEL_DEFAULT, workers=None, processes=False, passthrough=None):
+    """
+    Deflates every eligible section on a thread (or process) pool.
+    Returns a list of (flags, payload) for each section, in order.
+
+    Notes:
+    * 'passthrough' maps section indices to already-final (flags, payload) pairs, e.g.,
+      the original compressed payloads of base RPX sections that were not modified.
+    """
+
+    if passthrough is None:
+        passthrough = {}
+
+    payloads = [passthrough[i] if i in passthrough else (section.flags, section.data) for i, section in enumerate(sections)]
+
+    # Largest sections first, so one huge .text does not end up being the last job in the queue
+    indices = sorted(
+        (i for i, section in enumerate(sections) if i not in passthrough and isCompressible(section)),
+        key=lambda i: len(sections[i].data),
+        reverse=True
+    )
+
+    if not indices:
+        return payloads
+
+    executor_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_type(max_workers=workers) as executor:
+        futures = [(i, executor.submit(compressData, sections[i].data, level)) for i in indices]
+
+        for i, future in futures:
+            payload = future.result()
+
+            # Keep the section uncompressed if deflate did not make it any smaller
+            if len(payload) < len(sections[i].data):
+                payloads[i] = (sections[i].flags | SHF_RPL_ZLIB, payload)
+
+    return payloads
+
+
+def getPassthrough(base_rpx, count, is_modified):
+    """
+    Collects the original (flags, payload) of the first 'count' sections of 'base_rpx'
+    for which 'is_modified(index)' is false, alongside their original CRCs.
+    """
+
+    passthrough = {}
+    crcs = {}
+
+    base_crcs = base_rpx.crcs
+    if base_crcs is None:
+        return passthrough, crcs
+
+    for i, section in enumerate(base_rpx.sections[:count]):
+        if section.type in (SHT_NOBITS, SHT_RPL_CRCS, SHT_RPL_FILEINFO) or is_modified(i):
+            continue
+
+        passthrough[i] = (section.flags, section.payload)
+        crcs[i] = base_crcs[i]
+
+    return passthrough, crcs
+
+
+def saveRpx(header, sections, sh_str_idx, level=ZLIB_LEVEL_DEFAULT, workers=None, processes=False, passthrough=None):
+    """
+    Notes:
+    * 'sections' must be final, i.e., relocation sections must have had their data rebuilt already.
+    * 'header.type' is expected to be set to the RPL type (0xFE01) by the caller.
+    """
+
+    payloads = compressSections(sections, level, workers, processes, passthrough)
+
+    outBuffer = bytearray(header.save(sections, sh_str_idx))
+
+    padSize = align(len(outBuffer), 0x10) - len(outBuffer)
+    outBuffer += b'\0' * padSize
+
+    offset = align(len(outBuffer) + len(sections) * sections[0].size, SECTION_DATA_ALIGN)
+
+    data_offsets = []
+    for i, (section, (flags, payload)) in enumerate(zip(sections, payloads)):
+        if i == 0:
+            outBuffer += struct.pack(section.format, *((0,) * 10))
+            data_offsets.append(0)
+            continue
+
+        if section.type == SHT_NOBITS:
+            section_offset = 0
+            section_size = len(section.data)
+
+        else:
+            section_offset = offset
+            section_size = len(payload)
+            if section_size:
+                offset = align(offset + section_size, SECTION_DATA_ALIGN)
+
+        outBuffer += struct.pack(
+            section.format,
+            section.nameIdx,
+            section.type,
+            flags,
+            section.vAddr,
+            section_offset,
+            section_size,
+            section.link,
+            section.info,
+            section.addrAlign,
+            section.entSize
+        )
+
+        data_offsets.append(section_offset)
+
+    for section, (_, payload), section_offset in zip(sections, payloads, data_offsets):
+        if section.type == SHT_NOBITS or not payload:
+            continue
+
+        outBuffer += b'\0' * (section_offset - len(outBuffer))
+        outBuffer += payload
+
+    return outBuffer
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# CafeLoader patch-apply simulator - Applies the CafeLoader outputs of a target to a sparse address space,
+# the way the loader does, so that their cost can be measured and their result verified without hardware
+
+
+# Built-in
+import os
+import struct
+import time
+
+
+# Local
+from .elf import ELF
+from .index import SectionIndex
+from .patch import loadPatches
+from .payload import loadPayload
+from .payload import PAYLOAD_FORMAT_RAW
+from .rpx import RPX
+
+
+PAGE_SIZE = 0x1000
+
+
+class SparseMemory:
+    """
+    Sparse 32-bit address space, allocated one page at a time on first write.
+    Unwritten memory reads as zero.
+    """
+
+    def __init__(self, page_size=PAGE_SIZE):
+        assert page_size > 0 and page_size & (page_size - 1) == 0
+
+        self.pageSize = page_size
+        self.pages = {}
+
+    def write(self, address, data):
+        page_size = self.pageSize
+        pages = self.pages
+
+        data = memoryview(data).cast('B')
+        pos = 0
+        size = len(data)
+
+        while pos < size:
+            page_address = (address + pos) & ~(page_size - 1)
+            page_offset = address + pos - page_address
+            chunk_size = min(page_size - page_offset, size - pos)
+
+            page = pages.get(page_address)
+            if page is None:
+                page = pages[page_address] = bytearray(page_size)
+
+            page[page_offset:page_offset + chunk_size] = data[pos:pos + chunk_size]
+            pos += chunk_size
+
+    def read(self, address, size):
+        page_size = self.pageSize
+        pages = self.pages
+
+        out = bytearray()
+        pos = 0
+
+        while pos < size:
+            page_address = (address + pos) & ~(page_size - 1)
+            page_offset = address + pos - page_address
+            chunk_size = min(page_size - page_offset, size - pos)
+
+            page = pages.get(page_address)
+            if page is None:
+                out += b'\0' * chunk_size
+            else:
+                out += page[page_offset:page_offset + chunk_size]
+
+            pos += chunk_size
+
+        return out
+
+    def getTouchedPageCount(self):
+        return len(self.pages)
+
+
+class LoaderSimulator:
+    """
+    Applies Addr.bin, Code.bin, Data.bin and Patches.hax of a CafeLoader target, in that order.
+    """
+
+    def __init__(self, page_size=PAGE_SIZE):
+        self.memory = SparseMemory(page_size)
+
+        self.textAddr = None
+        self.dataAddr = None
+
+        self.codeSize = 0
+        self.dataSize = 0
+
+        self.patches = []  # (address, data) per applied Patches.hax record, expanded
+
+        self.recordCount = 0
+        self.byteCount = 0
+        self.elapsed = 0.0
+
+    def load(self, addr_data, code_data, data_data, patches_data, payload_format=PAYLOAD_FORMAT_RAW):
+        start = time.perf_counter()
+
+        self.textAddr, self.dataAddr = struct.unpack_from(">II", addr_data)
+
+        memory_write = self.memory.write
+
+        # The payloads are in the target's "PayloadFormat", which the loader decodes as it applies them
+        code_data = loadPayload(code_data, payload_format)
+        data_data = loadPayload(data_data, payload_format)
+
+        if code_data:
+            memory_write(self.textAddr, code_data)
+            self.codeSize = len(code_data)
+
+        if data_data:
+            memory_write(self.dataAddr, data_data)
+            self.dataSize = len(data_data)
+
+        patches = loadPatches(patches_data)
+        for address, data in patches:
+            memory_write(address, data)
+
+        self.elapsed = time.perf_counter() - start
+
+        self.patches = patches
+        self.recordCount = len(patches)
+        self.byteCount = self.codeSize + self.dataSize + sum(len(data) for _, data in patches)
+
+    def loadDirectory(self, path, payload_format=PAYLOAD_FORMAT_RAW):
+        def read(name, required):
+            file = os.path.join(path, name)
+            if not os.path.isfile(file):
+                if required:
+                    raise FileNotFoundError("Could not find %s in: %s" % (name, path))
+
+                return b''
+
+            with open(file, "rb") as inf:
+                return inf.read()
+
+        self.load(
+            read("Addr.bin", True),
+            read("Code.bin", False),
+            read("Data.bin", False),
+            read("Patches.hax", True),
+            payload_format
+        )
+
+    def verify(self, rpx_path, translate=None):
+        """
+        Compares every applied Patches.hax record against the bytes at the same address in the Emulator RPX.
+        Returns a list of (address, size, expected data, simulated data) per mismatching record.
+
+        Notes:
+        * Code.bin and Data.bin are linked at the console addresses, while the Emulator RPX places the same
+          code after the base sections, so they are not compared.
+        * 'translate', if given, converts a (console) patch address to the matching Emulator RPX address
+          (i.e., through the address conversion map), and raises IndexError for unmapped addresses.
+        * Branch and function pointer hooks encode addresses that differ between both builds.
+          Words that differ are accepted if both are references (branch targets or raw values) to the same thing:
+          the same offset into the hax code or data, or matching base addresses through 'translate'.
+        """
+
+        elf = ELF(RPX(rpx_path).decompress())
+        find_section = SectionIndex.fromELF(elf).find
+        memory_read = self.memory.read
+
+        # Hax sections are appended to the Emulator RPX without a name
+        hax_sections = [entry for entry in elf.secHeadEnts if entry.flags & 2 and entry.size_ > 0 and entry.name == 'None']
+        hax_regions = []
+        for is_code in (True, False):
+            entries = [entry for entry in hax_sections if bool(entry.flags & 4) == is_code]  # SHF_EXECINSTR
+            if entries:
+                rpx_start = min(entry.vAddr for entry in entries)
+                rpx_end = max(entry.vAddr + entry.size_ for entry in entries)
+                start = self.textAddr if is_code else self.dataAddr
+                hax_regions.append((start, start + rpx_end - rpx_start, rpx_start - start))
+
+        def is_same_reference(value, rpx_value):
+            for start, end, offset in hax_regions:
+                if start <= value < end:
+                    return (value + offset) & 0xFFFFFFFF == rpx_value
+
+            if translate is not None:
+                try:
+                    return translate(value) == rpx_value
+                except IndexError:
+                    return False
+
+            return value == rpx_value
+
+        def is_same_word(word, rpx_word, address, rpx_address):
+            if is_same_reference(word, rpx_word):
+                return True
+
+            # Relative (I-form) branches, with the same link bit
+            if word >> 26 == 18 and rpx_word >> 26 == 18 and not word & 2 and (word ^ rpx_word) & 3 == 0:
+                sign_extend = lambda li: li - 0x04000000 if li & 0x02000000 else li
+                return is_same_reference(
+                    (address + sign_extend(word & 0x03FFFFFC)) & 0xFFFFFFFF,
+                    (rpx_address + sign_extend(rpx_word & 0x03FFFFFC)) & 0xFFFFFFFF
+                )
+
+            return False
+
+        def is_same_record(expected, simulated, address, rpx_address):
+            # Whole (aligned) words may differ by reference only; any other byte must match
+            size = len(expected)
+            word_start = min(-address & 3, size)
+            word_count = (size - word_start) // 4
+            word_end = word_start + word_count * 4
+
+            if expected[:word_start] != simulated[:word_start] or expected[word_end:] != simulated[word_end:]:
+                return False
+
+            words = struct.unpack_from(">%dI" % word_count, simulated, word_start)
+            rpx_words = struct.unpack_from(">%dI" % word_count, expected, word_start)
+
+            for i, (word, rpx_word) in enumerate(zip(words, rpx_words)):
+                pos = word_start + i * 4
+                if word != rpx_word and not is_same_word(word, rpx_word, address + pos, rpx_address + pos):
+                    return False
+
+            return True
+
+        mismatches = []
+
+        for address, data in self.patches:
+            size = len(data)
+            simulated = memory_read(address, size)
+
+            try:
+                rpx_address = address if translate is None else translate(address)
+            except IndexError:
+                mismatches.append((address, size, None, simulated))
+                continue
+
+            section = find_section(rpx_address)
+            if section is None or section[0].type == 8 or rpx_address + size > section[3]:
+                mismatches.append((address, size, None, simulated))
+                continue
+
+            entry, _, entry_start, _ = section
+
+            offset = rpx_address - entry_start
+            expected = bytes(entry.data[offset:offset + size])
+            if expected == simulated:
+                continue
+
+            if not is_same_record(expected, simulated, address, rpx_address):
+                mismatches.append((address, size, expected, simulated))
+
+        return mismatches
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Output stripping - Drops symbols that are of no use in the output, and compacts the string table to match
+# https://docs.oracle.com/cd/E23824_01/html/819-0690/chapter6-79797.html
+
+
+# Built-in
+import struct
+
+
+STB_LOCAL       = 0
+
+STT_FILE        = 4
+
+SHN_UNDEF       = 0x0000
+SHN_LORESERVE   = 0xFF00
+SHN_ABS         = 0xFFF1
+
+# Sections that are never carried into the output
+STRIP_SECTION_NAMES = ("/DISCARD/", ".comment")
+
+
+def stripSymbols(elf, symtab, strtab, relas, section_map):
+    """
+    Strips file symbols, symbols of stripped sections and unreferenced local symbols from 'symtab',
+    rebuilds 'strtab' with the names that are left, and updates the symbol indices in 'relas'.
+
+    Notes:
+    * 'section_map' maps section indices of 'elf' to section indices of the output.
+      Symbols defined in any other section are made absolute.
+    * Symbols referenced by a relocation in 'relas' are always kept.
+    """
+
+    assert symtab.entSize == 0x10
+
+    endian = elf.header.endian
+    elf32_sym_struct = struct.Struct("%sIIIBBH" % endian)
+    elf32_sym_struct_unpack_from = elf32_sym_struct.unpack_from
+    elf32_sym_struct_pack = elf32_sym_struct.pack
+
+    section_headers = elf.secHeadEnts
+    stripped_sections = set(
+        i for i, entry in enumerate(section_headers)
+        if entry.name in STRIP_SECTION_NAMES
+    )
+
+    referenced = set()
+    for rela in relas:
+        if rela is not None:
+            referenced.update(rel.info >> 8 for rel in rela.relocations)
+
+    symtab_data = symtab.data
+    strtab_data = strtab.data
+
+    new_symtab_data = bytearray(symtab_data[:0x10])  # Null symbol
+    new_strtab_data = bytearray(b'\0')
+    new_str_offsets = {}
+
+    sym_map = {0: 0}
+    local_count = 1
+
+    for i, pos in enumerate(range(0x10, len(symtab_data), 0x10), 1):
+        st_name, st_value, st_size, st_info, st_other, st_shndx = elf32_sym_struct_unpack_from(symtab_data, pos)
+
+        is_local = st_info >> 4 == STB_LOCAL
+
+        if i not in referenced:
+            if st_info & 0xF == STT_FILE or \
+               st_shndx in stripped_sections or \
+               is_local:
+                continue
+
+        if SHN_UNDEF < st_shndx < SHN_LORESERVE:
+            st_shndx = section_map.get(st_shndx, SHN_ABS)
+
+        if st_name:
+            name_end = strtab_data.find(b'\0', st_name)
+            name = bytes(strtab_data[st_name:name_end if name_end != -1 else len(strtab_data)])
+            if name in new_str_offsets:
+                st_name = new_str_offsets[name]
+
+            else:
+                st_name = len(new_strtab_data)
+                new_str_offsets[name] = st_name
+                new_strtab_data += name
+                new_strtab_data.append(0)
+
+        sym_map[i] = len(new_symtab_data) // 0x10
+        new_symtab_data += elf32_sym_struct_pack(st_name, st_value, st_size, st_info, st_other, st_shndx)
+
+        if is_local:
+            local_count = sym_map[i] + 1
+
+    for rela in relas:
+        if rela is not None:
+            for rel in rela.relocations:
+                rel.info = (sym_map[rel.info >> 8] << 8) | (rel.info & 0xFF)
+
+    symtab.data = new_symtab_data
+    symtab.info = local_count  # Index of the first non-local symbol
+
+    strtab.data = new_strtab_data
@@ -31,6 +31,19 @@ class AddressConvert:
 
         return address
 
+    def unresolve(self, address):
+        # Inverse of resolve()
+        if self.ranges:
+            for range_, offset in self.ranges.items():
+                if address - offset in range_:
+                    address -= offset
+                    break
+
+            else:
+                self.addressOutOfRange(address)
+
+        return address
+
 
 class PlatformAddressConvert(AddressConvert):
     def __init__(self, platform_name, base):
@@ -44,6 +57,9 @@ class PlatformAddressConvert(AddressConvert):
     def resolve(self, address):
         return AddressConvert.resolve(self, self.base.resolve(address))
 
+    def unresolve(self, address):
+        return self.base.unresolve(AddressConvert.unresolve(self, address))
+
 
 class AddressConvertEmulator(PlatformAddressConvert):
     def __init__(self, base):
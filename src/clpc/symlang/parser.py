@@ -6,6 +6,7 @@ from .addrConv import AddressConvert
 from .addrConv import AddressConvertCafeLoader
 from .addrConv import AddressConvertEmulator
 from .addrConv import PlatformType
+from .reader import TokenReader
 from .token import Token
 from .token import TokenType
 
@@ -238,6 +239,27 @@ class AddressConversionMap:
 
         return text_addr_resolved, data_addr_resolved, platforms
 
+    @staticmethod
+    def fromFile(path):
+        """
+        Reads the address conversion map file at 'path'.
+        Returns (TextAddr, DataAddr, platforms), like resolve().
+        """
+
+        reader = TokenReader()
+        reader.openFile(path)
+
+        try:
+            is_valid, text_addr, data_addr, statements = AddressConversionMap.start(reader)
+            if not is_valid:
+                line, col = reader.indexToCoordinates(reader.file_str, reader.nextToken.srcPosAt)
+                raise ValueError("At line %d, column %d: syntax error" % (line, col))
+
+            return AddressConversionMap.resolve(reader, text_addr, data_addr, statements)
+
+        finally:
+            reader.closeFile()
+
     @classmethod
     def start(cls, reader):
         data_addr = None
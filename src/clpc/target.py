@@ -7,8 +7,11 @@ import os
 
 
 # Local
+from .cemu import EMULATOR_OUTPUTS
 from .common import NormalizePath
+from .hook import isHexString
 from .module import Module
+from .payload import PAYLOAD_FORMATS
 
 
 class Target:
@@ -26,6 +29,11 @@ class Target:
 
         self.baseRpxName = None
 
+        self.patchesVersion = None  # None -> Inherit (or default)
+        self.payloadFormat = None   # None -> Inherit (or default)
+        self.emulatorOutput = None  # None -> Inherit (or default)
+        self.titleIds = None        # None -> Inherit (or default)
+
         self.remove_Modules = []
         self.remove_BuildOptions = []
 
@@ -47,6 +55,10 @@ class Target:
         self.addrMapName            = other.addrMapName
         self.addrMap                = other.addrMap
         self.baseRpxName            = other.baseRpxName
+        self.patchesVersion         = other.patchesVersion
+        self.payloadFormat          = other.payloadFormat
+        self.emulatorOutput         = other.emulatorOutput
+        self.titleIds               = other.titleIds
         self.remove_Modules         = other.remove_Modules
         self.remove_BuildOptions    = other.remove_BuildOptions
         self.add_Modules            = other.add_Modules
@@ -66,6 +78,18 @@ class Target:
         if other.baseRpxName != "@inherit":
             self.baseRpxName = other.baseRpxName
 
+        if other.patchesVersion is not None:
+            self.patchesVersion = other.patchesVersion
+
+        if other.payloadFormat is not None:
+            self.payloadFormat = other.payloadFormat
+
+        if other.emulatorOutput is not None:
+            self.emulatorOutput = other.emulatorOutput
+
+        if other.titleIds is not None:
+            self.titleIds = other.titleIds
+
         for module_name in other.remove_Modules:
             if module_name in self.add_Modules:
                 del self.add_Modules[module_name]
@@ -125,6 +149,10 @@ class Target:
             "Abstract",
             "AddrMap",
             "BaseRpx",
+            "PatchesVersion",
+            "PayloadFormat",
+            "EmulatorOutput",
+            "TitleIds",
             "Remove/Modules",
             "Add/Modules",
             "Remove/BuildOptions",
@@ -217,6 +245,73 @@ class Target:
 
             target.baseRpxName = base_rpx_name
 
+        ### Patches.hax Version Reading ###
+        # print("%s Patches.hax Version Reading" % target_field_name)
+
+        if "PatchesVersion" in obj:
+            patches_version = obj["PatchesVersion"]
+            if patches_version is not None:
+                if patches_version not in (1, 2) or isinstance(patches_version, bool):
+                    error("In %s, expected \"PatchesVersion\" to be 1 or 2, received: %r" % (target_field_name, patches_version))
+                    return None
+
+                target.patchesVersion = patches_version
+
+        ### Code.bin/Data.bin Format Reading ###
+        # print("%s Code.bin/Data.bin Format Reading" % target_field_name)
+
+        if "PayloadFormat" in obj:
+            payload_format = obj["PayloadFormat"]
+            if payload_format is not None:
+                if payload_format not in PAYLOAD_FORMATS:
+                    error("In %s, expected \"PayloadFormat\" to be one of %s, received: %r" % (target_field_name, ", ".join(map(repr, PAYLOAD_FORMATS)), payload_format))
+                    return None
+
+                target.payloadFormat = payload_format
+
+        ### Emulator Output Reading ###
+        # print("%s Emulator Output Reading" % target_field_name)
+
+        if "EmulatorOutput" in obj:
+            emulator_output = obj["EmulatorOutput"]
+            if emulator_output is not None:
+                if emulator_output not in EMULATOR_OUTPUTS:
+                    error("In %s, expected \"EmulatorOutput\" to be one of %s, received: %r" % (target_field_name, ", ".join(map(repr, EMULATOR_OUTPUTS)), emulator_output))
+                    return None
+
+                target.emulatorOutput = emulator_output
+
+        ### Title IDs Reading ###
+        # print("%s Title IDs Reading" % target_field_name)
+
+        if "TitleIds" in obj:
+            title_ids = obj["TitleIds"]
+            if title_ids is not None:
+                if isinstance(title_ids, str):
+                    title_ids = [title_ids]
+
+                elif not isinstance(title_ids, list) or not title_ids:
+                    error("In %s, expected \"TitleIds\" to be a string or list of strings" % target_field_name)
+                    return None
+
+                title_ids_field_name = "%s Title ID" % target_field_name
+
+                new_title_ids = []
+
+                for title_id in title_ids:
+                    title_id = proj.processString(title_ids_field_name, title_id, error=error)
+                    if title_id is None:
+                        return None
+
+                    title_id = title_id.strip()
+                    if not (len(title_id) == 16 and isHexString(title_id)):
+                        error("In %s, expected a 16-digit hex string, received: %r" % (title_ids_field_name, title_id))
+                        return None
+
+                    new_title_ids.append(title_id.upper())
+
+                target.titleIds = new_title_ids
+
         ### Modules Removal List Reading ###
         # print("%s Modules Removal List Reading" % target_field_name)
 
@@ -2,12 +2,36 @@
 # -*- coding: utf-8 -*-
 
 
+from clpc.cemu import CEMU_CODECAVE_ADDR
+from clpc.cemu import CEMU_CODECAVE_DATA_OFFSET
+from clpc.cemu import CEMU_CODECAVE_SIZE
+from clpc.cemu import CemuPatchSink
+from clpc.cemu import EMULATOR_OUTPUT_CEMU
+from clpc.cemu import EMULATOR_OUTPUT_RPX
+from clpc.cemu import getModuleMatches as cemu_getModuleMatches
+from clpc.cemu import getPatchFileName as cemu_getPatchFileName
+from clpc.cemu import saveGraphicPack as cemu_saveGraphicPack
 from clpc.common import align
-from clpc.common import PACK_U16
 from clpc.common import PACK_U32
 from clpc import Project
 from clpc.symlang.addrConv import PlatformType
 from clpc.elf import ELF, readString as elf_readString
+from clpc.hook import PatchHook
+from clpc.hook import resolveSymbols as hook_resolveSymbols
+from clpc.hookColumns import HookColumns
+from clpc.image import BaseImage
+from clpc.patch import findOverlaps as patch_findOverlaps
+from clpc.patch import loadPatches as patch_loadPatches
+from clpc.patchgen import checkPatchRange as patch_checkPatchRange
+from clpc.patchgen import consumePatches as patch_consumePatches
+from clpc.patchgen import OverlayPatchSink
+from clpc.patchgen import PatchesHaxSink
+from clpc.patchgen import SimulatorSink
+from clpc.payload import PAYLOAD_FORMAT_RAW
+from clpc.payload import savePayload
+from clpc.rpx import getPassthrough as rpx_getPassthrough
+from clpc.simulator import SparseMemory
+from clpc.strip import stripSymbols as strip_symbols
 import glob
 import os
 import struct
@@ -18,7 +42,15 @@ import sys
 
 # Change the following (use / instead of \)
 GHS_PATH = os.environ.get("GHS_ROOT", "D:/Greenhills/ghs/multi5327")
-wiiurpxtool = os.environ.get("CLPC_WIIURPXTOOL_PATH", "D:/NSMBU RE/v1.3.0/code/wiiurpxtool.exe")
+
+# RPX output options
+RPX_ZLIB_LEVEL = int(os.environ.get("CLPC_RPX_ZLIB_LEVEL", "6"))
+RPX_WORKERS = int(os.environ.get("CLPC_RPX_WORKERS", "0")) or None  # 0 -> One worker per CPU
+RPX_USE_PROCESSES = os.environ.get("CLPC_RPX_USE_PROCESSES", "0") == "1"
+SAVE_ELF = os.environ.get("CLPC_SAVE_ELF", "0") == "1"  # Also write the intermediate (uncompressed) ELF
+
+# CafeLoader output options
+SIMULATE_PATCHES = os.environ.get("CLPC_SIMULATE_PATCHES", "0") == "1"  # Check Patches.hax against the streamed patches
 
 
 GPJ_TEMPLATE = """#!gbuild
@@ -61,6 +93,19 @@ SECTIONS {
 """
 
 
+def getDataBuffer(data_addr, sections):
+    # Dense image of 'sections' from 'data_addr' to the end of the last one
+    data_end = max((entry.vAddr + entry.size_ for entry in sections if entry is not None), default=data_addr)
+    data_buf = bytearray(data_end - data_addr)
+
+    for data_entry in sections:
+        if data_entry is not None:
+            data_offset = data_entry.vAddr - data_addr
+            data_buf[data_offset:data_offset + data_entry.size_] = data_entry.data
+
+    return data_buf
+
+
 def buildProject(proj, target_name, platform_type, error=print):
     platform_names = {
         PlatformType.Emulator: "Emulator",
@@ -92,6 +137,10 @@ def buildProject(proj, target_name, platform_type, error=print):
         bases.append(base)
         base = base.base
 
+    # Cemu graphic pack instead of a rebuilt RPX
+    emulator_output = next((base.emulatorOutput for base in bases if base.emulatorOutput is not None), EMULATOR_OUTPUT_RPX)
+    cemu_output = platform_type == PlatformType.Emulator and emulator_output == EMULATOR_OUTPUT_CEMU
+
     modules = dict(proj.modules)
     build_options = list(proj.buildOptions)
 
@@ -222,17 +271,17 @@ def buildProject(proj, target_name, platform_type, error=print):
                   "%s" % (target_field_name, base_rpx_path))
             return False
 
-        base_elf_path = os.path.join(rpx_dir_path, "%s.elf" % base_rpx_filename)
+        rpx_cache_path = os.path.join(temp_path, "rpxs")
+        if not os.path.isdir(rpx_cache_path):
+            os.mkdir(rpx_cache_path)
+            assert os.path.isdir(rpx_cache_path)
 
-        print("Decompressing RPX...")
-        if not os.path.isfile(base_elf_path):
-            DETACHED_PROCESS = 0x00000008
-            subprocess.call("\"%s\" -d \"%s\" \"%s\"" % (wiiurpxtool, base_rpx_path, base_elf_path), creationflags=DETACHED_PROCESS)
+        print("Loading RPX...\n")
+        base_image = BaseImage.fromFile(base_rpx_path, rpx_cache_path)
+        base_rpx = base_image.rpx
+        base_elf = base_image.createOverlay()
 
-            assert os.path.isfile(base_elf_path)
-
-        print("Loading ELF...\n")
-        base_elf = ELF(base_elf_path)
+        base_section_count = len(base_elf.secHeadEnts)
 
         rpl_fileinfo = base_elf.secHeadEnts.pop()
         if rpl_fileinfo.type != 0x80000004:
@@ -240,7 +289,8 @@ def buildProject(proj, target_name, platform_type, error=print):
                   "%s" % (target_field_name, base_rpx_path))
             return False
 
-        rpl_fileinfo_data = rpl_fileinfo.data
+        rpl_fileinfo_data = bytearray(rpl_fileinfo.data)
+        base_elf.setData(rpl_fileinfo, rpl_fileinfo_data)
         if len(rpl_fileinfo_data) < 0x14:
             error("In %s, SHT_RPL_FILEINFO data is malformed (unexpected end of data) in RPX file:\n"
                   "%s" % (target_field_name, base_rpx_path))
@@ -258,14 +308,19 @@ def buildProject(proj, target_name, platform_type, error=print):
                   "%s" % (target_field_name, base_rpx_path))
             return False
 
-        base_text_end = max(entry.vAddr + entry.size_ for entry in base_elf.secHeadEnts if 0x02000000 <= entry.vAddr < 0x10000000)
-        base_data_end = max(entry.vAddr + entry.size_ for entry in base_elf.secHeadEnts if 0x10000000 <= entry.vAddr < 0xC0000000)
-        base_dyna_end = max(entry.vAddr + entry.size_ for entry in base_elf.secHeadEnts if 0xC0000000 <= entry.vAddr < 0xC8000000)
+        base_text_end = base_image.textEnd
+        base_data_end = base_image.dataEnd
+        base_dyna_end = base_image.dynaEnd
 
         base_text_addr  = base_text_end
         base_data_addr  = base_data_end
         syms_addr       = base_dyna_end
 
+        if cemu_output:
+            # The hax code and data live in the Cemu code cave, and the base RPX is left as-is
+            base_text_addr  = CEMU_CODECAVE_ADDR
+            base_data_addr  = CEMU_CODECAVE_ADDR + CEMU_CODECAVE_DATA_OFFSET
+
     f_align = align
     text_addr = f_align(base_text_addr, text_align_all)
     data_addr = f_align(base_data_addr, data_align_all)
@@ -279,6 +334,70 @@ def buildProject(proj, target_name, platform_type, error=print):
         with open(addr_out_path, "wb") as outf:
             outf.write(addrdata)
 
+    if platform_type != PlatformType.CafeLoader and addrconv is None:
+        f_addrconv_resolve = None
+        symbols = dict(proj.symbols)
+
+    else:
+        f_addrconv_resolve = platforms[platform_type].resolve
+        symbols = dict((symbol, f_addrconv_resolve(address)) for symbol, address in proj.symbols.items())
+
+    print("Checking patches...")
+
+    try:
+        hook_columns = HookColumns.fromModules(modules.values(), f_addrconv_resolve)
+    except Exception as e:
+        error(e)
+        return False
+
+    hook_sizes = []
+    hook_field_names = []
+
+    for module_name, module in modules.items():
+        module_field_name = "Module %r" % os.path.splitext(os.path.basename(module_name))[0]
+
+        for i, hook in enumerate(module.hooks):
+            hook_sizes.append(hook.getDataSize())
+
+            # Hooks are numbered in module order (including those from hook tables)
+            hook_field_name = "%s Hook #%d (%s" % (module_field_name, i, type(hook).__name__)
+            hook_funcs = hook.getSymbols()
+            if hook_funcs:
+                hook_field_name += " -> %s" % ', '.join(hook_funcs)
+
+            hook_field_names.append(hook_field_name + ')')
+
+    patch_ranges = [
+        (address, hook_sizes[hook_index], hook_field_names[hook_index])
+        for address, hook_index in zip(hook_columns.addresses, hook_columns.hookIndices)
+    ]
+
+    patch_overlaps = patch_findOverlaps(patch_ranges)
+    if patch_overlaps:
+        error("In %s, found %d overlapping patch(es):\n"
+              "%s" % (target_field_name, len(patch_overlaps), '\n'.join(
+                  "[0x%08X, 0x%08X) in %s overlaps [0x%08X, 0x%08X) in %s" % (
+                      address_b, address_b + size_b, owner_b,
+                      address_a, address_a + size_a, owner_a
+                  )
+                  for (address_a, size_a, owner_a), (address_b, size_b, owner_b) in patch_overlaps
+              )))
+        return False
+
+    if platform_type == PlatformType.Emulator and not cemu_output:
+        # Same index the patches are applied with, so this reports exactly the patches that are skipped
+        base_section_index = base_image.getSectionIndex()
+
+        patch_skips = []
+        for address, size, owner in patch_ranges:
+            _, reason = patch_checkPatchRange(base_section_index, address, size)
+            if reason is not None:
+                patch_skips.append("[0x%08X, 0x%08X) in %s: %s" % (address, address + size, owner, reason))
+
+        if patch_skips:
+            print("Skipping %d patch(es) that cannot be applied to the base RPX:\n"
+                  "%s" % (len(patch_skips), '\n'.join(patch_skips)))
+
     gpj_str_lst = [
         GPJ_TEMPLATE % obj_path.replace('\\', '/'),
         "\t-DPLATFORM_IS_EMULATOR=%d" % int(platform_type == PlatformType.Emulator),
@@ -324,14 +443,6 @@ def buildProject(proj, target_name, platform_type, error=print):
 
     print("\nLinking...")
 
-    if platform_type != PlatformType.CafeLoader and addrconv is None:
-        f_addrconv_resolve = None
-        symbols = dict(proj.symbols)
-
-    else:
-        f_addrconv_resolve = platforms[platform_type].resolve
-        symbols = dict((symbol, f_addrconv_resolve(address)) for symbol, address in proj.symbols.items())
-
     symbol_map_str = MAP_TEMPLATE % (
         '\n'.join(
             ("\t%s = 0x%08X;" % item) for item in symbols.items()
@@ -342,9 +453,16 @@ def buildProject(proj, target_name, platform_type, error=print):
     with open(symbol_map_path, 'w', encoding="utf8") as outf:
         outf.write(symbol_map_str)
 
+    text_area_end = 0x10000000
+    data_area_end = 0xC0000000
+    if cemu_output:
+        # Code and data share the Cemu code cave
+        text_area_end = data_addr
+        data_area_end = CEMU_CODECAVE_ADDR + CEMU_CODECAVE_SIZE
+
     proj_ld_str = LD_TEMPLATE % (
-        text_addr, 0x10000000 - text_addr,
-        data_addr, 0xC0000000 - data_addr,
+        text_addr, text_area_end - text_addr,
+        data_addr, data_area_end - data_addr,
         text_align,
         rodata_align,
         data_align,
@@ -368,6 +486,12 @@ def buildProject(proj, target_name, platform_type, error=print):
     cmd = ' '.join(cmd_lst)
     error_code = subprocess.call(cmd)
     if error_code:
+        if cemu_output:
+            error("Link Failed!!\n"
+                  "Error code: %i\n"
+                  "Note: The code must fit in 0x%X bytes and the data in 0x%X bytes of the Cemu code cave" % (error_code, data_addr - text_addr, data_area_end - data_addr))
+            return False
+
         error("Link Failed!!\n"
               "Error code: %i" % error_code)
         return False
@@ -389,9 +513,15 @@ def buildProject(proj, target_name, platform_type, error=print):
         rela_data = proj_obj.getSectionByName(".rela.data")
 
     elif platform_type == PlatformType.CafeLoader:
+        payload_format = next((base.payloadFormat for base in bases if base.payloadFormat is not None), PAYLOAD_FORMAT_RAW)
+
+        code_buf = savePayload(text.data, payload_format)
+        if payload_format != PAYLOAD_FORMAT_RAW:
+            print("Code.bin: 0x%X -> 0x%X bytes (%s)" % (len(text.data), len(code_buf), payload_format))
+
         code_path = os.path.join(target_out_path, "Code.bin")
         with open(code_path, "wb") as outf:
-            outf.write(text.data)
+            outf.write(code_buf)
 
     data_end = 0
     if rodata is not None:
@@ -405,17 +535,15 @@ def buildProject(proj, target_name, platform_type, error=print):
 
     elif platform_type == PlatformType.CafeLoader:
         if data_end > 0:
-            data_size = data_end - data_addr
-            data_buf = bytearray(data_size)
+            data_buf = getDataBuffer(data_addr, (rodata, data))
 
-            for data_entry in rodata, data:
-                if data_entry is not None:
-                    data_offset = data_entry.vAddr - data_addr
-                    data_buf[data_offset:data_offset + data_entry.size_] = data_entry.data
+            data_payload_buf = savePayload(data_buf, payload_format)
+            if payload_format != PAYLOAD_FORMAT_RAW:
+                print("Data.bin: 0x%X -> 0x%X bytes (%s)" % (len(data_buf), len(data_payload_buf), payload_format))
 
             data_path = os.path.join(target_out_path, "Data.bin")
             with open(data_path, "wb") as outf:
-                outf.write(data_buf)
+                outf.write(data_payload_buf)
 
     symtab  = proj_obj.getSectionByName(".symtab")
     strtab  = proj_obj.getSectionByName(".strtab")
@@ -453,7 +581,65 @@ def buildProject(proj, target_name, platform_type, error=print):
             else:
                 assert symbols[name] == st_value
 
-    if platform_type == PlatformType.Emulator:
+    try:
+        hook_symbols = hook_resolveSymbols(hook_columns.hooks, symbols)
+    except KeyError as e:
+        error("In %s, %s" % (target_field_name, e.args[0]))
+        return False
+
+    if cemu_output:
+        print("Building Cemu graphic pack...")
+
+        title_ids = next((base.titleIds for base in bases if base.titleIds is not None), [])
+        if not title_ids:
+            print("Warning: \"TitleIds\" is not set, the graphic pack will not match any title until \"titleIds\" is filled in.")
+
+        cemu_sink = CemuPatchSink()
+
+        try:
+            (cemu_patch_lines,) = patch_consumePatches(
+                hook_columns.generatePatches(hook_symbols),
+                (cemu_sink,)
+            )
+        except Exception as e:
+            error(e)
+            return False
+
+        pack_name = "%s %s" % (proj_name, target_name)
+
+        try:
+            rules_str, patch_file_str = cemu_saveGraphicPack(
+                pack_name,
+                "%s/%s" % (proj_name, target_name),
+                title_ids,
+                cemu_getModuleMatches(base_rpx),
+                text.data,
+                getDataBuffer(data_addr, (rodata, data)),
+                cemu_patch_lines
+            )
+        except ValueError as e:
+            error("In %s, %s" % (target_field_name, e))
+            return False
+
+        print("Wrote %d patch(es)" % cemu_sink.count)
+
+        pack_path = os.path.join(proj_out_path, "%s_cemu" % target_name)
+        if not os.path.isdir(pack_path):
+            os.mkdir(pack_path)
+            assert os.path.isdir(pack_path)
+
+        with open(os.path.join(pack_path, "rules.txt"), 'w', encoding="utf8") as outf:
+            outf.write(rules_str)
+
+        with open(os.path.join(pack_path, cemu_getPatchFileName(pack_name)), 'w', encoding="utf8") as outf:
+            outf.write(patch_file_str)
+
+        # Written by older versions; Cemu would also apply it with the legacy Cemuhook parser
+        legacy_patches_path = os.path.join(pack_path, "patches.txt")
+        if os.path.isfile(legacy_patches_path):
+            os.remove(legacy_patches_path)
+
+    elif platform_type == PlatformType.Emulator:
         # sh_str_base = len(base_elf.shStrTable.data)
 
         text.nameIdx = 0  # sh_str_base; base_elf.shStrTable.data += b".textHaxx\0"; sh_str_base += 10
@@ -498,22 +684,36 @@ def buildProject(proj, target_name, platform_type, error=print):
             base_elf.secHeadEnts.append(symtab)
             symtab.flags = base_elf.getSectionByName(".symtab").flags
 
-            syms_addr = f_align(syms_addr, symtab.addrAlign)
-            symtab.vAddr = syms_addr
-            syms_addr += len(symtab.data)
-
         if strtab:
             strtab.nameIdx = 0  # sh_str_base; base_elf.shStrTable.data += b".strtabHaxx\0"; sh_str_base += 12
             base_elf.secHeadEnts.append(strtab)
             strtab.flags = base_elf.getSectionByName(".strtab").flags
 
+        base_elf.secHeadEnts.append(rpl_crcs)
+        base_elf.secHeadEnts.append(rpl_fileinfo)
+
+        if symtab and strtab:
+            print("Stripping symbols...")
+            strip_symbols(
+                proj_obj, symtab, strtab,
+                (rela_text, rela_rodata, rela_data),
+                dict(
+                    (proj_obj.secHeadEnts.index(entry), base_elf.secHeadEnts.index(entry))
+                    for entry in (text, rodata, data, bss) if entry is not None
+                )
+            )
+
+        # Placed after stripping, so that only what is left grows the loaded image
+        if symtab:
+            syms_addr = f_align(syms_addr, symtab.addrAlign)
+            symtab.vAddr = syms_addr
+            syms_addr += len(symtab.data)
+
+        if strtab:
             syms_addr = f_align(syms_addr, strtab.addrAlign)
             strtab.vAddr = syms_addr
             syms_addr += len(strtab.data)
 
-        base_elf.secHeadEnts.append(rpl_crcs)
-        base_elf.secHeadEnts.append(rpl_fileinfo)
-
         text_end = text.vAddr + text.size_
 
         data_end = 0
@@ -569,130 +769,87 @@ def buildProject(proj, target_name, platform_type, error=print):
         if symtab and strtab:
             symtab.link = base_elf.secHeadEnts.index(strtab)
 
-        base_text   = base_elf.getSectionByName(".text")
-        base_rodata = base_elf.getSectionByName(".rodata")
-        base_data   = base_elf.getSectionByName(".data")
-        base_bss    = base_elf.getSectionByName(".bss")
-
-        base_rela_text      = base_elf.getSectionByName(".rela.text")
-        base_rela_rodata    = base_elf.getSectionByName(".rela.rodata")
-        base_rela_data      = base_elf.getSectionByName(".rela.data")
-
-        entry_ranges = tuple(
-            (range(entry.vAddr, entry.vAddr + entry.size_), entry, entry_rela)
-            for entry, entry_rela in zip(
-                (base_text,         base_rodata,        base_data,      base_bss),
-                (base_rela_text,    base_rela_rodata,   base_rela_data, None),
-            )
-            if entry is not None
-        )
-
         print("Applying patches...")
 
-        for module in modules.values():
-            for hook in module.hooks:
-                for address in hook.address:
-                    if f_addrconv_resolve is not None:
-                        try:
-                            address = f_addrconv_resolve(address)
-                        except Exception as e:
-                            error(e)
-                            return False
-
-                    try:
-                        data = hook.getData(address, symbols)
-                    except Exception as e:
-                        error(e)
-                        return False
-
-                    data_len = len(data)
-
-                    end_address = address + data_len
-
-                    for entry_range, entry, entry_rela in entry_ranges:
-                        if address in entry_range:
-                            break
-
-                    else:
-                        print("Patch at unknown region.")
-                        print("Skipping patch at address: 0x%08X" % address)
-                        continue
-
-                    if entry is base_bss:
-                        print("Patching .bss is not possible.")
-                        print("Skipping patch at address: 0x%08X" % address)
-                        continue
-
-                    if end_address > entry.vAddr + entry.size_:
-                        print("Patch exceeds section range.")
-                        print("Skipping patch at address: 0x%08X" % address)
-                        continue
-
-                    if entry_rela is not None:
-                        patch_range = range(address, end_address)
-
-                        remove_indices = []
+        try:
+            patch_consumePatches(
+                hook_columns.generatePatches(hook_symbols),
+                (OverlayPatchSink(base_elf, base_image, verbose=False),)
+            )
+        except Exception as e:
+            error(e)
+            return False
 
-                        for i, rel in enumerate(entry_rela.relocations):
-                            if rel.offset in patch_range:
-                                # print("Found relocation at address: 0x%08X, removing..." % rel.offset)
-                                remove_indices.append(i)
+        # Sections of the base RPX that were not touched are copied over still compressed, along with their CRCs
+        rpx_passthrough, rpx_passthrough_crcs = rpx_getPassthrough(
+            base_rpx, base_section_count - 2,
+            lambda i: base_elf.isModified(base_elf.secHeadEnts[i])
+        )
 
-                        for i in reversed(remove_indices):
-                            del entry_rela.relocations[i]
+        z_crc32 = zlib.crc32
+        f_get_data = base_elf.getData
+        pack_u32 = PACK_U32
 
-                    offset = address - entry.vAddr
-                    entry.data[offset:offset + data_len] = data
-                    # print("Patched %d byte(s) at address: 0x%08X" % (data_len, address))
+        rpl_crcs_data = []
+        for i, section in enumerate(base_elf.secHeadEnts):
+            if i in rpx_passthrough_crcs:
+                rpl_crcs_data.append(pack_u32(rpx_passthrough_crcs[i]))
+                continue
 
-        z_crc32 = zlib.crc32
-        rpl_crcs.data = b''.join((struct.pack(">I", (z_crc32(section.data) & 0xFFFFFFFF)) if section.type not in (8, 0x80000003) and section.data else b'\0\0\0\0') for section in base_elf.secHeadEnts)
+            # Fetched once, as relocation sections are serialized on every call
+            section_data = f_get_data(section) if section.type not in (8, 0x80000003) else None
+            rpl_crcs_data.append(pack_u32(z_crc32(section_data) & 0xFFFFFFFF) if section_data else b'\0\0\0\0')
 
-        # TODO(aboood40091): Strip filename symbols
-        # TODO(aboood40091): Strip "/DISCARD/" and ".comment" sections
+        base_elf.setData(rpl_crcs, b''.join(rpl_crcs_data))
 
         elf_path = os.path.join(proj_out_path, "%s.elf" % target_name)
         rpx_path = os.path.join(proj_out_path, "%s.rpx" % target_name)
 
-        print("Saving ELF...")
-        buf = base_elf.save()
-        with open(elf_path, "wb") as outf:
-            outf.write(buf)
+        if SAVE_ELF:
+            print("Saving ELF...")
+            buf = base_elf.save()
+            with open(elf_path, "wb") as outf:
+                outf.write(buf)
 
         print("Compressing RPX...")
-        DETACHED_PROCESS = 0x00000008
-        subprocess.call("\"%s\" -c \"%s\" \"%s\"" % (wiiurpxtool, elf_path, rpx_path), creationflags=DETACHED_PROCESS)
+        buf = base_elf.saveRpx(RPX_ZLIB_LEVEL, RPX_WORKERS, RPX_USE_PROCESSES, rpx_passthrough)
+        with open(rpx_path, "wb") as outf:
+            outf.write(buf)
 
     elif platform_type == PlatformType.CafeLoader:
         print("Building patches...")
 
-        pack_u16 = PACK_U16
+        patches_version = next((base.patchesVersion for base in bases if base.patchesVersion is not None), 1)
+        patches_sink = PatchesHaxSink(patches_version)
 
-        patch_count = sum(len(hook.address) for module in modules.values() for hook in module.hooks)
-        patch_buf = bytearray(pack_u16(patch_count))
+        patch_sinks = [patches_sink]
+        if SIMULATE_PATCHES:
+            # Fed from the same stream, in parallel with the Patches.hax writer
+            patch_sinks.append(SimulatorSink(SparseMemory()))
 
-        for module in modules.values():
-            for hook in module.hooks:
-                for address in hook.address:
-                    try:
-                        address = f_addrconv_resolve(address)
-                    except Exception as e:
-                        error(e)
-                        return False
+        try:
+            patch_buf, *patch_sink_results = patch_consumePatches(
+                hook_columns.generatePatches(hook_symbols),
+                patch_sinks
+            )
+        except Exception as e:
+            error(e)
+            return False
+
+        print("Wrote %d patch(es) as %d record(s)" % (patches_sink.patchCount, patches_sink.recordCount))
 
-                    try:
-                        data = hook.getData(address, symbols)
-                    except Exception as e:
-                        error(e)
-                        return False
+        if SIMULATE_PATCHES:
+            (streamed_memory,) = patch_sink_results
 
-                    data_len = len(data)
+            loaded_memory = SparseMemory()
+            for address, data in patch_loadPatches(patch_buf):
+                loaded_memory.write(address, data)
 
-                    patch_buf += pack_u16(data_len)
-                    patch_buf += pack_u32(address)
-                    patch_buf += data
+            if loaded_memory.pages != streamed_memory.pages:
+                error("In %s, Patches.hax does not write the same bytes as the generated patches" % target_field_name)
+                return False
 
-                    # print("Patched %d byte(s) at address: 0x%08X" % (data_len, address))
+            print("Simulated Patches.hax matches the generated patches (%d page(s))" % streamed_memory.getTouchedPageCount())
 
         patches_path = os.path.join(target_out_path, "Patches.hax")
         with open(patches_path, "wb") as outf:
@@ -729,7 +886,12 @@ def main():
             continue
 
         for platform_type in platform_types:
-            if not buildProject(proj, target_name, platform_type, error):
+            success = buildProject(proj, target_name, platform_type, error)
+
+            # The build is over, along with the patches that referenced the mapped patch files
+            PatchHook.closeFiles()
+
+            if not success:
                 return
 
             print()
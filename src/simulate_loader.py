@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Simulates CafeLoader applying the outputs of a target (clpc.simulator)
+# Reports the amount of work the loader has to do, and optionally verifies the result against the Emulator RPX.
+
+
+from clpc.payload import PAYLOAD_FORMAT_RAW
+from clpc.payload import PAYLOAD_FORMATS
+from clpc.simulator import LoaderSimulator
+from clpc.simulator import PAGE_SIZE
+from clpc.symlang.addrConv import PlatformType
+from clpc.symlang.parser import AddressConversionMap
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate CafeLoader applying Addr.bin, Code.bin, Data.bin and Patches.hax.")
+    parser.add_argument("target_out_path", help="CafeLoader output directory of the target")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default=PAYLOAD_FORMAT_RAW, help="\"PayloadFormat\" of the target, i.e., the format of Code.bin and Data.bin (default: %s)" % PAYLOAD_FORMAT_RAW)
+    parser.add_argument("--rpx", help="Emulator RPX of the same target to verify the patched bytes against")
+    parser.add_argument("--convmap", help="address conversion map (.convmap) of the target, to convert console addresses to Emulator ones")
+    parser.add_argument("--page-size", type=lambda s: int(s, 0), default=PAGE_SIZE, help="simulated page size (default: 0x%X)" % PAGE_SIZE)
+    parser.add_argument("--max-mismatches", type=int, default=20, help="maximum number of mismatches to print (default: 20)")
+    args = parser.parse_args()
+
+    simulator = LoaderSimulator(args.page_size)
+    simulator.loadDirectory(args.target_out_path, args.payload_format)
+
+    print("Text address:  0x%08X (0x%X bytes)" % (simulator.textAddr, simulator.codeSize))
+    print("Data address:  0x%08X (0x%X bytes)" % (simulator.dataAddr, simulator.dataSize))
+    print("Records:       %d" % simulator.recordCount)
+    print("Bytes written: 0x%X" % simulator.byteCount)
+    print("Touched pages: %d (0x%X bytes each)" % (simulator.memory.getTouchedPageCount(), args.page_size))
+    print("Elapsed:       %.2f ms" % (simulator.elapsed * 1000))
+
+    if args.rpx is None:
+        return
+
+    translate = None
+    if args.convmap is None:
+        print("\nNo address conversion map given, addresses are compared as-is.")
+
+    else:
+        _, _, platforms = AddressConversionMap.fromFile(args.convmap)
+        cafeloader = platforms[PlatformType.CafeLoader]
+        emulator = platforms[PlatformType.Emulator]
+        translate = lambda address: emulator.resolve(cafeloader.unresolve(address))
+
+    print("\nVerifying against: %s" % args.rpx)
+    mismatches = simulator.verify(args.rpx, translate)
+    if not mismatches:
+        print("All %d record(s) match." % simulator.recordCount)
+        return
+
+    print("%d of %d record(s) do not match:" % (len(mismatches), simulator.recordCount))
+    for address, size, expected, simulated in mismatches[:args.max_mismatches]:
+        if expected is None:
+            print("  0x%08X (0x%X bytes): not mapped to a loaded RPX section" % (address, size))
+        else:
+            print("  0x%08X (0x%X bytes): expected %s, got %s" % (address, size, expected[:16].hex(), bytes(simulated[:16]).hex()))
+
+
+if __name__ == "__main__":
+    main()